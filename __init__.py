@@ -1,48 +1,112 @@
 """Flask is a micro python-based web technology or framework that it very
   enjoyable to work with backend of these application
 
-  our app is initialize in __init__.py file"""
+  our app is initialize in __init__.py file.
+
+  The extensions are created here without an app and create_app() ties them to
+  one. Importing flaskblog is therefore cheap: nothing connects to the database,
+  no mail or image library is imported, and each deployment passes its own
+  config. For gunicorn use flaskblog.wsgi:app (with --preload the app is built
+  once in the master and shared by every forked worker), for an ASGI server
+  flaskblog.asgi:app."""
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
-from flask_mail import Mail
-
-# Create instance of Flask
-app = Flask(__name__)
-
-"""Secret-key will help our website to be protected from
-from different attacks like CSRF attack which stands for 
-Cross-site forgery attack.
-To generate a secret-key , open up terminal ... 
-start python .... import secrets ... secrets.token_hex(16)."""
-app.config['SECRET_KEY'] = '5791628bb0b13ce0c676dfde280ba245'
-
-"""Database URI will help us to set a location for our database """
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-# initialize the database
-db = SQLAlchemy(app)
-# initialize the bcrypt (hashing the password)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+from sqlalchemy.orm import configure_mappers
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flaskblog.config import Config
+from flaskblog.database import BlogSQLAlchemy
+from flaskblog.async_db import AsyncDatabase
+from flaskblog.hashing import PasswordHasher
+from flaskblog.cache import PageCache
+from flaskblog.identity import IdentityCache
+from flaskblog.tokens import ResetTokens
+from flaskblog.instrumentation import Instrumentation
+from flaskblog.mailqueue import MailQueue
+from flaskblog.images import AvatarProcessor
+from flaskblog.static_cache import StaticCache
+
+# opt-in timing spans, Server-Timing, /metrics and slow request profiles
+instrumentation = Instrumentation()
+# the database
+db = BlogSQLAlchemy()
+# async engine (aiosqlite) of the async views in the ASGI mode (see asgi.py)
+async_db = AsyncDatabase()
+# hashing the password (bcrypt on a process pool)
+hasher = PasswordHasher()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 login_manager.login_message_category = 'info'
+"""emails are not sent inside the request, they wait in an outbox table
+and a background thread sends them in batches (see mailqueue.py)"""
+mail_queue = MailQueue()
+# uploaded profile pictures are resized in the background (see images.py)
+avatars = AvatarProcessor()
+# static files get a content hash in their url, a strong ETag and are cached for a year
+static_cache = StaticCache()
+# rendered pages of anonymous visitors (see cache.py)
+page_cache = PageCache()
+# the logged-in user, so load_user doesn't hit the database on every request
+identity_cache = IdentityCache()
+# password reset tokens (used ones can't be replayed) and the reset rate limits
+reset_tokens = ResetTokens()
+
+
+def create_app(config=Config):
+    """build the app. config is a class/object with upper case attributes
+    (like config.Config) or a dict of settings on top of Config."""
+    # Create instance of Flask
+    app = Flask(__name__)
+    if isinstance(config, dict):
+        app.config.from_object(Config)
+        app.config.update(config)
+    else:
+        app.config.from_object(config)
+    app.config.setdefault('POSTS_PER_PAGE', 5)
+    app.config.setdefault('PROXY_FIX_X_FOR', 0)
+    if app.config['PROXY_FIX_X_FOR']:
+        # the client address from X-Forwarded-For, set by the proxies in front of us
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    # initialize the extensions with this app
+    instrumentation.init_app(app)
+    db.init_app(app)
+    async_db.init_app(app)
+    hasher.init_app(app)
+    login_manager.init_app(app)
+    mail_queue.init_app(app, db)
+    avatars.init_app(app, db)
+    static_cache.init_app(app)
+    page_cache.init_app(app)
+    identity_cache.init_app(app, db)
+    reset_tokens.init_app(app)
+
+    from flaskblog.routes import main
+    """follow the path flaskblog < erorrs < handlers and from there import errors
+    which is instance of Blueprint
+    """
+    from flaskblog.erorrs.handlers import errors
+    # versioned JSON read API (/api/v1/...)
+    from flaskblog.api.routes import api
 
-app.config['MAIL_SERVER'] = 'smtp.googlemail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = 'Jabiraziz430@gmail.com'
-app.config['MAIL_PASSWORD'] = 'Jabir@123'
-# initialize the mail or cannot mail with the flask app
-mail = Mail(app)
+    """Now to make the above blueprints work...
+    register that blueprints with the app"""
+    app.register_blueprint(main)
+    app.register_blueprint(errors)
+    app.register_blueprint(api)
 
-from flaskblog import routes
+    # flask upgrade-db command (schema migrations for an existing site.db)
+    from flaskblog.migrations import upgrade_db_command
+    app.cli.add_command(upgrade_db_command)
+    # flask export-data / import-data (streaming dumps of the users and posts)
+    from flaskblog.bulk import export_data_command, import_data_command
+    app.cli.add_command(export_data_command)
+    app.cli.add_command(import_data_command)
+    # full-text search index of the posts and the flask reindex-search command
+    from flaskblog import search
+    search.init_app(app, db)
 
-"""follow the path flaskblog < erorrs < handlers and from there import errors 
-which is instance of Blueprint
-"""
-from flaskblog.erorrs.handlers import errors
+    # set up the relationships now: Post.author is a backref that only exists
+    # after that, and the async views use it before any query would do it
+    configure_mappers()
 
-"""Now to make the above blueprint work...
-register that blueprintwith the app"""
-app.register_blueprint(errors)
+    return app
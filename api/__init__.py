@@ -0,0 +1,3 @@
+"""JSON read API for the mobile clients.
+the blueprint lives in routes.py and is registered in flaskblog/__init__.py
+under /api/v1, a future incompatible version gets its own prefix."""
@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import json
+from flask import Blueprint, request, url_for, jsonify, abort, make_response
+from sqlalchemy.orm import lazyload
+from flaskblog.database import read_only
+from flaskblog.images import avatar_filename
+from flaskblog.models import User, Post
+from flaskblog.pagination import keyset_paginate
+
+try:
+    import brotli
+except ImportError:
+    # optional, without it responses are only gzipped
+    brotli = None
+
+# Create Blueprint
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+POST_FIELDS = ('id', 'title', 'excerpt', 'content', 'date_posted', 'author', 'url')
+MAX_PER_PAGE = 50
+# smaller bodies are not worth compressing
+MIN_COMPRESS_SIZE = 500
+
+
+def requested_fields():
+    """?fields=id,title returns only those keys (sparse fieldset), default is everything."""
+    raw = request.args.get('fields')
+    if not raw:
+        return POST_FIELDS
+    fields = tuple(field.strip() for field in raw.split(',') if field.strip())
+    unknown = [field for field in fields if field not in POST_FIELDS]
+    if unknown:
+        abort(make_response(jsonify(error=f'unknown fields: {", ".join(unknown)}',
+                                    allowed=list(POST_FIELDS)), 400))
+    return fields
+
+
+def post_query(fields):
+    # the content is the biggest column, don't even load it when it is not wanted.
+    # the author comes from the copied author_name/author_image, no join needed
+    if 'content' not in fields:
+        return Post.listing()
+    return Post.query.options(lazyload(Post.author))
+
+
+def post_to_dict(post, fields):
+    data = {}
+    if 'id' in fields:
+        data['id'] = post.id
+    if 'title' in fields:
+        data['title'] = post.title
+    if 'excerpt' in fields:
+        data['excerpt'] = post.excerpt
+    if 'content' in fields:
+        data['content'] = post.content
+    if 'date_posted' in fields:
+        data['date_posted'] = post.date_posted.isoformat() + 'Z'
+    if 'author' in fields:
+        data['author'] = {
+            'username': post.author_name,
+            'image_url': url_for('static', filename=avatar_filename(post.author_image, 64),
+                                 _external=True),
+        }
+    if 'url' in fields:
+        data['url'] = url_for('main.post', post_id=post.id, _external=True)
+    return data
+
+
+def conditional_json(payload):
+    """json response with a weak ETag; a client sending it back gets a 304.
+
+    the ETag is a hash of the payload: ids and date_posted alone would miss a
+    post whose title or content was edited, and an author who changed their
+    name or picture. weak, because the bytes differ between gzip and brotli."""
+    body = json.dumps(payload, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    response = make_response(body)
+    response.content_type = 'application/json'
+    response.set_etag(hashlib.sha1(body).hexdigest(), weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def page_payload(page, fields, endpoint, **values):
+    def link(cursor):
+        if cursor is None:
+            return None
+        return url_for(endpoint, cursor=cursor, fields=request.args.get('fields'),
+                       per_page=request.args.get('per_page'), _external=True, **values)
+    return {'posts': [post_to_dict(post, fields) for post in page.items],
+            'next': link(page.next_cursor),
+            'prev': link(page.prev_cursor)}
+
+
+def per_page():
+    return max(1, min(request.args.get('per_page', 10, type=int), MAX_PER_PAGE))
+
+
+@api.route('/posts')
+@read_only
+def posts():
+    fields = requested_fields()
+    page = keyset_paginate(post_query(fields), cursor=request.args.get('cursor'),
+                           per_page=per_page())
+    return conditional_json(page_payload(page, fields, 'api.posts'))
+
+
+@api.route('/posts/<int:post_id>')
+@read_only
+def post(post_id):
+    fields = requested_fields()
+    post = post_query(fields).get_or_404(post_id)
+    return conditional_json(post_to_dict(post, fields))
+
+
+@api.route('/users/<string:username>/posts')
+@read_only
+def user_posts(username):
+    fields = requested_fields()
+    user = User.query.filter_by(username=username).first_or_404()
+    page = keyset_paginate(post_query(fields).filter_by(author=user),
+                           cursor=request.args.get('cursor'), per_page=per_page())
+    return conditional_json(page_payload(page, fields, 'api.user_posts', username=username))
+
+
+@api.errorhandler(404)
+def not_found(error):
+    # json instead of the html 404 page
+    return jsonify(error='not found'), 404
+
+
+@api.after_request
+def compress(response):
+    """brotli if the client accepts it (and the package is installed), else gzip."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,9 @@
+"""Entry point for ASGI servers, e.g.
+    uvicorn --workers 4 flaskblog.asgi:app
+home, post, user_posts and reset_request run as async views on the event
+loop, the rest of the app on a thread pool (see async_app.py). Needs the
+aiosqlite package for the async SQLite engine."""
+from flaskblog import create_app
+from flaskblog.async_app import AsyncBlog
+
+app = AsyncBlog(create_app())
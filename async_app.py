@@ -0,0 +1,182 @@
+"""Serve the Flask app to an ASGI server.
+
+Flask itself is a WSGI app and runs every view on a thread, so with WSGI the
+number of requests in progress is capped by the number of worker threads,
+even when most of them just wait for the database. AsyncBlog is an ASGI app
+around it:
+
+- the endpoints in async_routes.ASYNC_VIEWS (home, post, user_posts,
+  reset_request) run as coroutines on the event loop, in a normal Flask
+  request context (sessions, flask_login, before/after request hooks,
+  error handlers all work as usual). Loading current_user and reading or
+  writing the page cache block, so they run on the thread pool (run_sync());
+- every other request runs the normal WSGI app on a pool of ASGI_THREADS
+  threads, so bcrypt, uploads and the forms never block the event loop.
+
+see asgi.py for the entry point."""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flaskblog import db, async_db
+from flaskblog.async_db import run_sync
+from flaskblog.async_routes import ASYNC_VIEWS
+
+
+def build_environ(scope, body):
+    """the WSGI environ of an ASGI http scope."""
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        # repeated headers are joined like a WSGI server does
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    # the whole body is read already (a chunked upload has no Content-Length)
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def _current_user():
+    return current_user._get_current_object()
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+def _environ_only(environ, start_response):
+    return []
+
+
+class AsyncBlog:
+    def __init__(self, app, threads=None):
+        self.app = app
+        app.config.setdefault('ASGI_THREADS', 8)
+        self.executor = ThreadPoolExecutor(max_workers=threads or app.config['ASGI_THREADS'],
+                                           thread_name_prefix='wsgi')
+        # the async views skip app.wsgi_app, so they need the ProxyFix of create_app() too
+        x_for = app.config.get('PROXY_FIX_X_FOR')
+        self.proxy_fix = ProxyFix(_environ_only, x_for=x_for) if x_for else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'{scope["type"]} connections are not supported')
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                # the client went away before it sent the whole request
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = build_environ(scope, b''.join(chunks))
+
+        view, view_args = self._async_view(environ)
+        if view is not None:
+            if self.proxy_fix is not None:
+                # rewrites REMOTE_ADDR (and so on) of the environ
+                self.proxy_fix(environ, None)
+            status, headers, chunks = await self._call_async(view, view_args, environ)
+        else:
+            status, headers, chunks = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._call_wsgi, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    def _async_view(self, environ):
+        """the async view of this request, (None, None) lets the WSGI app handle it
+        (also 404s, redirects and wrong methods, so they are answered as usual)."""
+        try:
+            endpoint, view_args = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None, None
+        return ASYNC_VIEWS.get(endpoint), view_args
+
+    async def _call_async(self, view, view_args, environ):
+        # what Flask.full_dispatch_request() does, with the view awaited
+        app = self.app
+        with app.request_context(environ):
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        await self._load_user()
+                        rv = await view(**view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.handle_exception(e)
+            body = b'' if environ['REQUEST_METHOD'] == 'HEAD' else response.get_data()
+            return response.status_code, _encode_headers(response.headers.items()), [body]
+
+    async def _load_user(self):
+        """flask_login loads the user on first use of current_user, which may
+        query the database: do it on the thread pool, before the view runs."""
+        user = await run_sync(_current_user)
+        if isinstance(user, db.Model):
+            # attach it to the session of this request, without a query
+            user = db.session.merge(user, load=False)
+        self.app.login_manager._update_request_context_with_user(user)
+
+    def _call_wsgi(self, environ):
+        started = []
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), _encode_headers(headers)]
+            return chunks.append
+
+        result = self.app(environ, start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started[0], started[1], chunks
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_db.dispose(self.app)
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
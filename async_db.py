@@ -0,0 +1,90 @@
+"""Async database access for the async views of the ASGI mode (see asgi.py).
+
+the async views only read, so the async engine connects to the read side:
+ASYNC_DATABASE_URL if set (e.g. postgresql+asyncpg://...), otherwise
+DATABASE_READ_URL or the SQLite file opened read-only, through aiosqlite.
+The connections of an async engine belong to the event loop that opened
+them, so every loop gets its own engine (there is one loop per ASGI worker).
+
+    async with async_db.session() as session:
+        post = await session.get(Post, post_id)
+
+the session doesn't expire objects and only loads what the query asked for,
+a lazy load (post.author when it isn't eager) raises instead of blocking."""
+import asyncio
+import weakref
+from flask import current_app, copy_current_request_context
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from flaskblog.database import apply_pragmas, is_read_only, sqlite_read_only_uri
+
+
+def async_url(app):
+    """the URL of the async engine, sqlite ones use the aiosqlite driver."""
+    uri = app.config['ASYNC_DATABASE_URL'] or app.config.get('DATABASE_READ_URL') or \
+        sqlite_read_only_uri(app, app.config['SQLALCHEMY_DATABASE_URI'])
+    if uri is None:
+        raise RuntimeError('set ASYNC_DATABASE_URL, in-memory SQLite databases '
+                           'cannot be shared with the async engine')
+    url = make_url(uri)
+    if url.drivername in ('sqlite', 'sqlite+pysqlite'):
+        url = url.set(drivername='sqlite+aiosqlite')
+    return url
+
+
+async def run_sync(func, *args):
+    """run blocking code (the sync db.session, the cache backends) on the
+    default thread pool with a copy of the current request context. the copy
+    has an app context, and so a g, of its own: return what the caller needs."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, copy_current_request_context(func), *args)
+
+
+class _AsyncDatabaseState:
+    """the engines of one app, one per event loop."""
+
+    def __init__(self):
+        self.engines = weakref.WeakKeyDictionary()
+
+
+class AsyncDatabase:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASYNC_DATABASE_URL', None)
+        app.config.setdefault('ASYNC_DB_POOL_SIZE', 10)
+        app.extensions['async_db'] = _AsyncDatabaseState()
+
+    @property
+    def engine(self):
+        """the engine of current_app for the running event loop, created on first use."""
+        from sqlalchemy.ext.asyncio import create_async_engine
+        app = current_app._get_current_object()
+        engines = app.extensions['async_db'].engines
+        loop = asyncio.get_running_loop()
+        engine = engines.get(loop)
+        if engine is None:
+            url = async_url(app)
+            options = {}
+            if url.drivername.startswith('sqlite'):
+                # aiosqlite gets no pool by default, a connection per query is slow
+                options = {'poolclass': AsyncAdaptedQueuePool,
+                           'pool_size': app.config['ASYNC_DB_POOL_SIZE'], 'max_overflow': 0}
+            engine = create_async_engine(url, **options)
+            apply_pragmas(engine.sync_engine, app.config.get('SQLITE_PRAGMAS'), read_only=is_read_only(url))
+            engines[loop] = engine
+        return engine
+
+    def session(self):
+        from sqlalchemy.ext.asyncio import AsyncSession
+        return AsyncSession(self.engine, expire_on_commit=False)
+
+    async def dispose(self, app=None):
+        """close the pooled connections of the running loop (ASGI shutdown).
+        app defaults to current_app."""
+        app = app or current_app._get_current_object()
+        engine = app.extensions['async_db'].engines.pop(asyncio.get_running_loop(), None)
+        if engine is not None:
+            await engine.dispose()
@@ -0,0 +1,81 @@
+"""Async versions of the busiest pages, used by the ASGI mode (asgi.py).
+
+home, post and user_posts read through the async engine (async_db.py), so
+while SQLite works the event loop serves other requests instead of a worker
+thread sitting idle. reset_request is async too: the parts that only exist
+as blocking code (form validation queries the user table, the outbox insert)
+run on the thread pool through run_sync().
+
+they render the same templates and use the same page cache tags as the
+views in routes.py, which still serve everything when the app runs on WSGI."""
+from flask import current_app, render_template, url_for, flash, redirect, request, abort
+from flask_login import current_user
+from sqlalchemy import select, func
+from flaskblog import page_cache, async_db
+from flaskblog.async_db import run_sync
+from flaskblog.forms import RequestResetForm
+from flaskblog.models import User, Post
+from flaskblog.pagination import keyset_paginate_async, cached_count_async
+from flaskblog.routes import tag_posts, send_reset_email, limit_reset_requests
+
+
+@page_cache.cached
+async def home():
+    cursor = request.args.get('cursor')
+    async with async_db.session() as session:
+        posts = await keyset_paginate_async(session, Post.listing_select(), cursor=cursor,
+                                            per_page=current_app.config['POSTS_PER_PAGE'])
+    page_cache.tag('home')
+    tag_posts(posts.items)
+    return render_template('home.html', posts=posts)
+
+
+@page_cache.cached
+async def post(post_id):
+    async with async_db.session() as session:
+        post = await session.get(Post, post_id)
+    if post is None:
+        abort(404)
+    tag_posts([post])
+    return render_template('post.html', title=post.title, post=post)
+
+
+@page_cache.cached
+async def user_posts(username):
+    cursor = request.args.get('cursor')
+    async with async_db.session() as session:
+        user = (await session.scalars(select(User).filter_by(username=username))).first()
+        if user is None:
+            abort(404)
+        posts = await keyset_paginate_async(session, Post.listing_select().filter_by(user_id=user.id),
+                                            cursor=cursor, per_page=current_app.config['POSTS_PER_PAGE'])
+        total = await cached_count_async(
+            f'user:{user.id}', session, select(func.count(Post.id)).filter_by(user_id=user.id))
+    page_cache.tag(f'user:{user.id}', f'author:{user.id}')
+    tag_posts(posts.items)
+    return render_template('user_posts.html', posts=posts, user=user, total=total)
+
+
+def _send_reset_email(email):
+    send_reset_email(User.query.filter_by(email=email).first())
+
+
+async def reset_request():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.home'))
+    form = RequestResetForm()
+    limit_reset_requests()
+    if await run_sync(form.validate_on_submit):
+        await run_sync(_send_reset_email, form.email.data)
+        flash('An email has been sent with instructions to reset your password.', 'info')
+        return redirect(url_for('main.login'))
+    return render_template('reset_request.html', title='Reset Password', form=form)
+
+
+# endpoint -> async view, asgi.py serves these endpoints with them
+ASYNC_VIEWS = {
+    'main.home': home,
+    'main.post': post,
+    'main.user_posts': user_posts,
+    'main.reset_request': reset_request,
+}
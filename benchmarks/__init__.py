@@ -0,0 +1,2 @@
+"""Benchmark scripts. Run them from the folder that contains flaskblog, e.g.
+python -m flaskblog.benchmarks.bench_indexes --posts 100000"""
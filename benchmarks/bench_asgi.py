@@ -0,0 +1,174 @@
+"""Many concurrent connections: WSGI on a thread pool vs the ASGI mode.
+
+both servers run in their own process on a seeded temp database with the
+page cache off, and get the same load: --connections clients that request
+home, post and user_posts in a loop (a new connection per request) for
+--seconds. reported per server and connection count: rps, p50/p95/p99 and
+failed requests (errors and timeouts).
+
+    wsgi  the app on a pool of --threads threads (like gunicorn --threads)
+    asgi  uvicorn with asgi.py: the async views on the event loop,
+          the rest on a pool of --threads threads (needs uvicorn)
+
+python -m flaskblog.benchmarks.bench_asgi --connections 10 100 500"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flaskblog.benchmarks.stats import summarize
+
+
+def serve(kind, db_path, port, threads):
+    """runs in the server process."""
+    from flaskblog.benchmarks.seed import bench_app
+    app = bench_app(db_path, PAGE_CACHE_ENABLED=False, ASGI_THREADS=threads)
+    if kind == 'asgi':
+        try:
+            import uvicorn
+        except ImportError:
+            raise SystemExit('the asgi server needs uvicorn (pip install uvicorn)')
+        from flaskblog.async_app import AsyncBlog
+        uvicorn.run(AsyncBlog(app), host='127.0.0.1', port=port, log_level='warning',
+                    backlog=4096, timeout_keep_alive=1)
+        return
+
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    class PoolWSGIServer(BaseWSGIServer):
+        """every connection is handled by one of a fixed number of threads."""
+        request_queue_size = 4096
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PoolWSGIServer('127.0.0.1', port, app, handler=QuietHandler).serve_forever()
+
+
+async def _get(port, path, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return int(data.split(b' ', 2)[1])
+
+
+async def load(port, connections, seconds, users, posts, timeout):
+    latencies = []
+    failed = 0
+    stop_at = time.perf_counter() + seconds
+
+    async def client(n):
+        nonlocal failed
+        rng = random.Random(n)
+        while time.perf_counter() < stop_at:
+            path = rng.choice(['/', f'/post/{rng.randint(1, posts)}', f'/user/user{rng.randint(1, users)}'])
+            start = time.perf_counter()
+            try:
+                status = await _get(port, path, timeout)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                status = None
+            if status != 200:
+                failed += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(connections)))
+    return dict(summarize(latencies, time.perf_counter() - begin), failed=failed)
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'the server exited with {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit('the server did not start')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    parser.add_argument('--connections', nargs='+', type=int, default=[10, 100, 500])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request counts as failed')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    # used internally to start a server process
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.db, args.port, args.threads)
+
+    from flaskblog import db
+    from flaskblog.benchmarks.seed import bench_app, seed
+    app = bench_app()
+    with app.app_context():
+        seed(db, args.users, args.posts)
+        db_path = db.engine.url.database
+        db.engine.dispose()
+
+    results = []
+    for kind in args.servers:
+        port = _free_port()
+        server = subprocess.Popen([sys.executable, '-m', 'flaskblog.benchmarks.bench_asgi', '--serve', kind,
+                                   '--db', db_path, '--port', str(port), '--threads', str(args.threads)])
+        try:
+            _wait_for_port(port, server)
+            # warm up the pools and caches
+            asyncio.run(load(port, 4, 1, args.users, args.posts, args.timeout))
+            for connections in args.connections:
+                result = asyncio.run(load(port, connections, args.seconds, args.users, args.posts, args.timeout))
+                results.append(dict(server=kind, connections=connections, **result))
+                if not args.json:
+                    print(f'{kind:<5} {connections:>6} connections: {result["rps"]:>8} rps  '
+                          f'p50 {result["p50_ms"]:>8} ms  p95 {result["p95_ms"]:>8} ms  '
+                          f'p99 {result["p99_ms"]:>8} ms  failed {result["failed"]}', flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+    if args.json:
+        print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Logins per second for several bcrypt costs and pool sizes.
+
+every 'login' is one check_password_hash() call, issued from CONCURRENCY
+request threads at the same time just like a threaded server would.
+
+python -m flaskblog.benchmarks.bench_bcrypt --costs 10 12 --workers 0 1 4"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from flaskblog.hashing import PasswordHasher
+
+
+def run(cost, workers, logins, concurrency):
+    app = Flask(__name__)
+    app.config['BCRYPT_LOG_ROUNDS'] = cost
+    app.config['BCRYPT_POOL_WORKERS'] = workers
+    hasher = PasswordHasher(app)
+
+    def login(_):
+        # like a request thread: the hasher reads its settings from the app
+        with app.app_context():
+            return hasher.check_password_hash(pw_hash, 'password')
+
+    with app.app_context():
+        pw_hash = hasher.generate_password_hash('password')
+    # warm up, so starting the pool processes is not measured
+    for _ in range(max(workers, 1)):
+        login(None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as threads:
+        results = list(threads.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    with app.app_context():
+        hasher.shutdown()
+    assert all(results)
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--costs', type=int, nargs='+', default=[4, 8, 10, 12])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({0, 1, os.cpu_count() or 1}))
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    print(f'{"cost":>4} {"workers":>7} {"logins/sec":>11}')
+    for cost in args.costs:
+        for workers in args.workers:
+            rate = run(cost, workers, args.logins, args.concurrency)
+            label = workers if workers else 'inline'
+            print(f'{cost:>4} {label:>7} {rate:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
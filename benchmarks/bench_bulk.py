@@ -0,0 +1,83 @@
+"""Throughput of flask export-data / import-data (bulk.py).
+
+seeds a temp database, exports the users and posts to JSON lines and csv
+files in a temp directory, then imports each dump into a fresh temp
+database. reported: rows/sec of every step and the peak memory of the
+process, which should stay flat however many posts there are (it includes
+the file pages SQLite maps with the mmap_size PRAGMA, up to 256 MB). for the
+post import also the rate of the inserts alone, without the index and search
+rebuild at the end. the post import runs with the listing indexes deferred
+and, for comparison, kept (--compare-indexes).
+
+python -m flaskblog.benchmarks.bench_bulk --posts 1000000"""
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.bulk import export_rows, import_rows, read_records
+
+
+def _peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _report(step, count, elapsed, loaded=None):
+    extra = f'  (inserts {count / loaded:,.0f} rows/sec)' if loaded else ''
+    print(f'{step:<32} {count:>9} rows {elapsed:>7.1f}s {count / elapsed:>10,.0f} rows/sec  '
+          f'peak {_peak_mb():,.0f} MB{extra}', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--formats', nargs='+', choices=['jsonl', 'csv'], default=['jsonl', 'csv'])
+    parser.add_argument('--compare-indexes', action='store_true',
+                        help='also import the posts with the indexes kept during the load')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bulk-')
+    try:
+        app = bench_app(os.path.join(workdir, 'source.db'))
+        with app.app_context():
+            seed(db, args.users, args.posts)
+            print(f'{args.users} users, {args.posts} posts, batches of {args.batch}, '
+                  f'peak after seeding {_peak_mb():,.0f} MB', flush=True)
+            for fmt in args.formats:
+                for kind in ('users', 'posts'):
+                    start = time.perf_counter()
+                    with open(os.path.join(workdir, f'{kind}.{fmt}'), 'w', encoding='utf-8', newline='') as out, \
+                            db.engine.connect() as connection:
+                        count = export_rows(connection, kind, out, fmt, args.batch)
+                    _report(f'export {kind} {fmt}', count, time.perf_counter() - start)
+            db.engine.dispose()
+
+        runs = [(fmt, True) for fmt in args.formats]
+        if args.compare_indexes:
+            runs.append((args.formats[0], False))
+        for fmt, defer_indexes in runs:
+            target = bench_app(os.path.join(workdir, f'target-{fmt}-{int(defer_indexes)}.db'))
+            with target.app_context():
+                db.create_all()
+                for kind in ('users', 'posts'):
+                    start = time.perf_counter()
+                    loaded = []
+                    with open(os.path.join(workdir, f'{kind}.{fmt}'), encoding='utf-8', newline='') as lines:
+                        count = import_rows(db.engine, kind, read_records(lines, fmt), args.batch,
+                                            progress=lambda n: loaded.append(time.perf_counter() - start),
+                                            defer_indexes=defer_indexes)
+                    label = f'import {kind} {fmt}' + ('' if defer_indexes or kind == 'users' else ' (indexes kept)')
+                    _report(label, count, time.perf_counter() - start, loaded[-1] if kind == 'posts' else None)
+                db.engine.dispose()
+            os.remove(os.path.join(workdir, f'target-{fmt}-{int(defer_indexes)}.db'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
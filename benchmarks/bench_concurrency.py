@@ -0,0 +1,106 @@
+"""Mixed read/write load: p99 latency of page views while posts are written.
+
+reader threads request home, post, user_posts and about, writer threads keep
+creating posts. the page cache is off so every request reaches SQLite.
+
+    python -m flaskblog.benchmarks.bench_concurrency --compare
+runs the same load twice in fresh processes:
+    baseline  rollback journal, default PRAGMAs, one pool for everything
+    tuned     the default config: WAL + PRAGMAs + read-only pool for the read views"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed, PASSWORD
+from flaskblog.benchmarks.stats import summarize
+
+PROFILES = {
+    'baseline': {'SQLITE_PRAGMAS': {}, 'DB_READ_ROUTING': False},
+    'tuned': {},
+}
+
+
+def run(profile, users, posts, readers, writers, seconds):
+    app = bench_app(PAGE_CACHE_ENABLED=False, WTF_CSRF_ENABLED=False,
+                    BCRYPT_LOG_ROUNDS=4, BCRYPT_POOL_WORKERS=0, **PROFILES[profile])
+    with app.app_context():
+        seed(db, users, posts)
+    latencies = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def record(kind, start, status):
+        with lock:
+            latencies[kind].append(time.perf_counter() - start)
+            if status >= 500:
+                errors[kind] += 1
+
+    def reader(n):
+        rng = random.Random(n)
+        client = app.test_client()
+        while time.perf_counter() < stop:
+            url = rng.choice(['/', f'/post/{rng.randint(1, posts)}',
+                              f'/user/user{rng.randint(1, users)}', '/about'])
+            start = time.perf_counter()
+            record('read', start, client.get(url).status_code)
+
+    def writer(n):
+        client = app.test_client()
+        client.post('/login', data={'email': f'user{n + 1}@demo.com', 'password': PASSWORD})
+        i = 0
+        while time.perf_counter() < stop:
+            i += 1
+            start = time.perf_counter()
+            response = client.post('/post/new', data={'title': f'load {n}-{i}',
+                                                      'content': 'written by the load test'})
+            record('write', start, response.status_code)
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)] + \
+              [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    return {kind: dict(summarize(values, elapsed), errors=errors[kind])
+            for kind, values in latencies.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='tuned')
+    parser.add_argument('--compare', action='store_true', help='run every profile in its own process')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--json', action='store_true', help='print the result as json')
+    args = parser.parse_args()
+
+    if not args.compare:
+        result = run(args.profile, args.users, args.posts, args.readers, args.writers, args.seconds)
+        print(json.dumps(result) if args.json else result)
+        return
+
+    print(f'{"profile":<9} {"kind":<6} {"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for profile in sorted(PROFILES):
+        argv = [sys.executable, '-m', 'flaskblog.benchmarks.bench_concurrency', '--json',
+                '--profile', profile, '--users', str(args.users), '--posts', str(args.posts),
+                '--readers', str(args.readers), '--writers', str(args.writers),
+                '--seconds', str(args.seconds)]
+        output = subprocess.run(argv, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        for kind, data in result.items():
+            print(f'{profile:<9} {kind:<6} {data["rps"]:>8} {data["p50_ms"]:>8} '
+                  f'{data["p95_ms"]:>8} {data["p99_ms"]:>8} {data["errors"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Query plan and latency of the listing queries before and after the
+post indexes (migration 1) are added to an existing database.
+
+python -m flaskblog.benchmarks.bench_indexes --posts 100000"""
+import argparse
+import time
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.migrations import upgrade_db
+from flaskblog.models import Post
+from flaskblog.pagination import keyset_paginate, keyset_criteria, encode_cursor
+
+
+def _plan(query):
+    # the plan of the statement as the app runs it, with bound parameters:
+    # with the values inlined SQLite can pick plans the real query never gets
+    compiled = query.statement.compile(db.engine)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def _keyset_query(cursor):
+    _, criteria, order_by = keyset_criteria(cursor)
+    return Post.query.filter(criteria).order_by(*order_by).limit(6)
+
+
+def _time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def measure(repeat):
+    home = Post.query.order_by(Post.date_posted.desc(), Post.id.desc()).limit(6)
+    by_user = Post.query.filter_by(user_id=1) \
+        .order_by(Post.date_posted.desc(), Post.id.desc()).limit(6)
+    # a cursor from deep inside the table, roughly "page 500"
+    deep = Post.query.order_by(Post.date_posted.desc(), Post.id.desc()).offset(2500).first()
+    result = {}
+    for name, query in (('home', home), ('user_posts', by_user)):
+        result[name] = {'plan': _plan(query), 'ms': _time(query.all, repeat)}
+    if deep is not None:
+        cursor = encode_cursor('n', deep)
+        result['home page 1 (keyset)'] = {'plan': [], 'ms': _time(
+            lambda: keyset_paginate(Post.query, per_page=5), repeat)}
+        result['home page ~500 (keyset)'] = {'plan': _plan(_keyset_query(cursor)), 'ms': _time(
+            lambda: keyset_paginate(Post.query, cursor=cursor, per_page=5), repeat)}
+    return result
+
+
+def report(title, result):
+    print(f'== {title}')
+    for name, data in result.items():
+        print(f'  {name:<26} {data["ms"]:8.2f} ms')
+        for line in data['plan']:
+            print(f'      {line}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = bench_app()
+    with app.app_context():
+        seed(db, args.users, args.posts)
+        # pretend this is an old site.db that was created before the indexes
+        for statement in ('DROP INDEX IF EXISTS ix_post_date_posted_id',
+                          'DROP INDEX IF EXISTS ix_post_user_id_date_posted',
+                          'PRAGMA user_version = 0'):
+            db.session.execute(statement)
+        db.session.commit()
+        report(f'without indexes ({args.posts} posts)', measure(args.repeat))
+        upgrade_db()
+        db.session.execute('ANALYZE')
+        report(f'after flask upgrade-db ({args.posts} posts)', measure(args.repeat))
+
+
+if __name__ == '__main__':
+    main()
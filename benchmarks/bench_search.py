@@ -0,0 +1,57 @@
+"""LIKE '%q%' scan against the FTS5 index for a few search terms.
+
+python -m flaskblog.benchmarks.bench_search --posts 1000000"""
+import argparse
+import time
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed, VOCABULARY
+from flaskblog.models import Post
+from flaskblog.search import reindex, search_posts
+
+
+def _time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    # a common, a medium and a rare word and a two word query
+    parser.add_argument('--terms', nargs='+', default=[
+        VOCABULARY[5], VOCABULARY[300], VOCABULARY[15000], f'{VOCABULARY[40]} {VOCABULARY[900]}'])
+    args = parser.parse_args()
+
+    app = bench_app()
+    with app.app_context():
+        start = time.perf_counter()
+        seed(db, args.users, args.posts)
+        print(f'seeded {args.posts} posts in {time.perf_counter() - start:.1f}s')
+        start = time.perf_counter()
+        with db.engine.begin() as connection:
+            reindex(connection)
+        print(f'flask reindex-search took {time.perf_counter() - start:.1f}s')
+
+        print(f'{"terms":<16} {"LIKE ms":>10} {"FTS5 ms":>10} {"FTS5 page 2 ms":>15}')
+        for terms in args.terms:
+            # what a naive search would do: every word somewhere in the content
+            like = Post.query
+            for word in terms.split():
+                like = like.filter(Post.content.like(f'%{word}%'))
+            like = like.order_by(Post.date_posted.desc()).limit(10)
+            first = search_posts(db.session, terms)
+            like_ms = _time(like.all, args.repeat)
+            fts_ms = _time(lambda: search_posts(db.session, terms), args.repeat)
+            page2_ms = _time(lambda: search_posts(db.session, terms, cursor=first.next_cursor),
+                             args.repeat)
+            print(f'{terms:<16} {like_ms:>10.1f} {fts_ms:>10.1f} {page2_ms:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
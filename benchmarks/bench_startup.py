@@ -0,0 +1,45 @@
+"""How long a fresh worker process needs to import flaskblog and build the app.
+
+every sample runs in a new python process, like a freshly started worker.
+it also checks that the heavy optional libraries are not imported at startup.
+
+python -m flaskblog.benchmarks.bench_startup --runs 10"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+SNIPPET = '''
+import sys, time
+start = time.perf_counter()
+import flaskblog
+imported = time.perf_counter()
+app = flaskblog.create_app()
+built = time.perf_counter()
+lazy = [name for name in ('PIL', 'flask_mail', 'redis', 'brotli') if name in sys.modules]
+print(imported - start, built - start, ','.join(lazy))
+'''
+
+
+def sample():
+    out = subprocess.run([sys.executable, '-c', SNIPPET], check=True,
+                         capture_output=True, text=True).stdout.split()
+    return float(out[0]), float(out[1]), out[2] if len(out) > 2 else ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = [sample() for _ in range(args.runs)]
+    imports = [s[0] * 1000 for s in samples]
+    total = [s[1] * 1000 for s in samples]
+    print(f'import flaskblog     median {statistics.median(imports):7.1f} ms  min {min(imports):7.1f} ms')
+    print(f'import + create_app  median {statistics.median(total):7.1f} ms  min {min(total):7.1f} ms')
+    loaded = {name for s in samples for name in s[2].split(',') if name}
+    print('heavy modules loaded at startup:', ', '.join(sorted(loaded)) or 'none')
+
+
+if __name__ == '__main__':
+    main()
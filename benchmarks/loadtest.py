@@ -0,0 +1,352 @@
+"""Load test of every route with a realistic mix of visitors.
+
+seeds a database with --users users and --posts posts (1k to 10M, in chunks),
+then --vusers threads act like visitors for --duration seconds. Each step a
+virtual user picks an action from the mix:
+
+    read      an anonymous page view: home, post, user_posts, about, search,
+              the JSON api or /stats
+    login     logout + login (bcrypt)
+    post      new post form + create a post
+    update    edit form + update one of its own posts
+    delete    delete one of its own posts
+    account   account page + save the account form
+    register  sign up a new user
+    reset     reset request (mail through the queue to a local SMTP sink),
+              then the reset form with a fresh token
+
+everything runs in this process against app.test_client(), nothing needs the
+network: the reset mails go to an SMTPSink on localhost.
+
+the result (rps and p50/p95/p99 per route, per action and in total, plus the
+git commit and the settings) is written as JSON, so two commits can be compared:
+
+    python -m flaskblog.benchmarks.loadtest --posts 100000 --output before.json
+    git checkout other-branch
+    python -m flaskblog.benchmarks.loadtest --posts 100000 --output after.json --compare before.json
+
+--db reuses a database file between runs (it is seeded only when empty), e.g.
+--db site.db to load-test a copy of the real data. Don't point it at a
+database you care about, the load test writes to it."""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from flaskblog import db, mail_queue
+from flaskblog.benchmarks.seed import bench_app, seed, PASSWORD
+from flaskblog.benchmarks.smtp_sink import SMTPSink
+from flaskblog.benchmarks.stats import summarize
+
+DEFAULT_MIX = 'read=70,login=8,post=8,update=4,delete=2,account=5,register=1,reset=2'
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def parse_mix(text):
+    """'read=70,post=30' -> {'read': 70.0, 'post': 30.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ACTIONS:
+            raise argparse.ArgumentTypeError(f'unknown action {name!r}, choose from {", ".join(ACTIONS)}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class VirtualUser:
+    """one visitor: an anonymous client for the page views and a logged-in
+    client (as user<n>) for everything that needs an account."""
+
+    def __init__(self, app, number, targets, recorder):
+        self.app = app
+        self.rng = random.Random(number)
+        self.user_id, self.username, self.email = targets.users[number % len(targets.users)]
+        self.targets = targets
+        self.number = number
+        self.recorder = recorder
+        self.anonymous = app.test_client()
+        self.client = app.test_client()
+        self.own_posts = []
+        self.counter = 0
+        self.request('login', self.client, 'POST /login', '/login',
+                      data={'email': self.email, 'password': PASSWORD})
+
+    def request(self, action, client, label, url, data=None):
+        start = time.perf_counter()
+        if data is None:
+            response = client.get(url)
+        else:
+            response = client.post(url, data=data)
+        self.recorder.record(action, label, time.perf_counter() - start, response.status_code)
+        return response
+
+    # -- the actions ----------------------------------------------------
+
+    def read(self):
+        rng = self.rng
+        post_id = rng.choice(self.targets.post_ids)
+        username = rng.choice(self.targets.users)[1]
+        label, url = rng.choice([
+            ('GET /', '/'),
+            ('GET /home', '/home'),
+            ('GET /post/<id>', f'/post/{post_id}'),
+            ('GET /post/<id>', f'/post/{post_id}'),
+            ('GET /user/<username>', f'/user/{username}'),
+            ('GET /user/<username>', f'/user/{username}'),
+            ('GET /about', '/about'),
+            ('GET /search', '/search?q=' + rng.choice(['flask', 'python', 'sqlite cache', 'token'])),
+            ('GET /api/v1/posts', '/api/v1/posts'),
+            ('GET /api/v1/posts/<id>', f'/api/v1/posts/{post_id}'),
+            ('GET /api/v1/users/<username>/posts', f'/api/v1/users/{username}/posts'),
+            ('GET /stats', '/stats'),
+        ])
+        self.request('read', self.anonymous, label, url)
+
+    def login(self):
+        self.request('login', self.client, 'GET /logout', '/logout')
+        self.request('login', self.client, 'GET /login', '/login')
+        self.request('login', self.client, 'POST /login', '/login',
+                     data={'email': self.email, 'password': PASSWORD})
+
+    def post(self):
+        self.counter += 1
+        self.request('post', self.client, 'GET /post/new', '/post/new')
+        self.request('post', self.client, 'POST /post/new', '/post/new',
+                     data={'title': f'load test {self.number}-{self.counter}',
+                           'content': 'written by the load test ' * self.rng.randint(5, 50)})
+        # not timed: find the id of the new post for update/delete
+        from flaskblog.models import Post
+        with self.app.app_context():
+            post_id = db.session.query(db.func.max(Post.id)).filter_by(user_id=self.user_id).scalar()
+            db.session.remove()
+        if post_id is not None and post_id not in self.targets.post_id_set:
+            self.own_posts.append(post_id)
+
+    def update(self):
+        if not self.own_posts:
+            return self.post()
+        post_id = self.rng.choice(self.own_posts)
+        self.request('update', self.client, 'GET /post/<id>/update', f'/post/{post_id}/update')
+        self.request('update', self.client, 'POST /post/<id>/update', f'/post/{post_id}/update',
+                     data={'title': f'updated {post_id}', 'content': 'updated by the load test'})
+
+    def delete(self):
+        if not self.own_posts:
+            return self.post()
+        post_id = self.own_posts.pop()
+        self.request('delete', self.client, 'POST /post/<id>/delete', f'/post/{post_id}/delete', data={})
+
+    def account(self):
+        self.request('account', self.client, 'GET /account', '/account')
+        self.request('account', self.client, 'POST /account', '/account',
+                     data={'username': self.username, 'email': self.email})
+
+    def register(self):
+        self.counter += 1
+        name = f'load{self.number}x{self.counter}x{self.rng.randint(0, 10 ** 6)}'
+        self.request('register', self.anonymous, 'GET /register', '/register')
+        self.request('register', self.anonymous, 'POST /register', '/register',
+                     data={'username': name, 'email': f'{name}@demo.com',
+                           'password': PASSWORD, 'confirm_password': PASSWORD})
+
+    def reset(self):
+        self.request('reset', self.anonymous, 'GET /reset_password', '/reset_password')
+        self.request('reset', self.anonymous, 'POST /reset_password', '/reset_password',
+                     data={'email': self.email})
+        # not timed: the token the mail would contain
+        from flaskblog.models import User
+        with self.app.app_context():
+            token = User.query.get(self.user_id).get_reset_token()
+            db.session.remove()
+        url = f'/reset_password/{token}'
+        self.request('reset', self.anonymous, 'GET /reset_password/<token>', url)
+        # the same password again, so the other actions can still log in
+        self.request('reset', self.anonymous, 'POST /reset_password/<token>', url,
+                     data={'password': PASSWORD, 'confirm_password': PASSWORD})
+
+
+ACTIONS = ('read', 'login', 'post', 'update', 'delete', 'account', 'register', 'reset')
+
+
+class Recorder:
+    def __init__(self):
+        self.routes = defaultdict(list)
+        self.actions = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+        self._lock = threading.Lock()
+
+    def record(self, action, label, seconds, status):
+        if not self.recording:
+            return
+        with self._lock:
+            self.routes[label].append(seconds)
+            self.actions[action].append(seconds)
+            # redirects are the normal answer to a form post
+            if status >= 400:
+                self.errors[label] += 1
+
+
+class Targets:
+    """seeded users and posts the virtual users read and act as. The posts
+    written by the load test are left out, they may be deleted meanwhile."""
+
+    def __init__(self, users, post_ids):
+        # (id, username, email)
+        self.users = users
+        self.post_ids = post_ids
+        self.post_id_set = set(post_ids)
+
+
+def prepare_database(app, users, posts, sample=10000):
+    """seed the database (unless it has posts already) and pick the targets."""
+    from flaskblog.models import User, Post
+    from flaskblog.search import reindex
+    with app.app_context():
+        db.create_all()
+        existing = Post.query.count()
+        if existing:
+            print(f'reusing a database with {existing} posts')
+        else:
+            start = time.perf_counter()
+            seed(db, users, posts)
+            with db.engine.begin() as connection:
+                reindex(connection)
+            print(f'seeded {users} users and {posts} posts in {time.perf_counter() - start:.1f}s')
+        random_order = db.func.random()
+        seeded_users = db.session.query(User.id, User.username, User.email) \
+            .filter(User.email.like('user%@demo.com')).order_by(random_order).limit(sample).all()
+        post_ids = [row[0] for row in db.session.query(Post.id)
+                    .filter(~Post.title.like('load test %'), ~Post.title.like('updated %'))
+                    .order_by(random_order).limit(sample)]
+        db.session.remove()
+    if not seeded_users or not post_ids:
+        raise SystemExit('the database has no seeded users/posts to load-test with')
+    return Targets([tuple(row) for row in seeded_users], post_ids)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    sink = SMTPSink().start()
+    app = bench_app(args.db, WTF_CSRF_ENABLED=False,
+                    BCRYPT_LOG_ROUNDS=args.bcrypt_rounds,
+                    PAGE_CACHE_ENABLED=not args.no_page_cache,
+                    # every virtual user comes from 127.0.0.1
+                    RESET_RATE_LIMIT_ENABLED=False,
+                    MAIL_SERVER='localhost', MAIL_PORT=sink.port, MAIL_USE_TLS=False,
+                    MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_QUEUE_POLL_INTERVAL=0.5)
+    targets = prepare_database(app, args.users, args.posts)
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    recorder = Recorder()
+    vusers = [VirtualUser(app, n, targets, recorder) for n in range(args.vusers)]
+    stop_at = None
+
+    def visit(vuser):
+        while time.perf_counter() < stop_at:
+            getattr(vuser, vuser.rng.choices(names, weights)[0])()
+
+    # warm up (caches, pools, lazily started threads), not recorded
+    stop_at = time.perf_counter() + args.warmup
+    threads = [threading.Thread(target=visit, args=(vuser,)) for vuser in vusers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    recorder.recording = True
+    stop_at = time.perf_counter() + args.duration
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=visit, args=(vuser,)) for vuser in vusers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    recorder.recording = False
+
+    # give the mail queue a moment to hand the reset mails to the sink
+    with app.app_context():
+        deadline = time.perf_counter() + 10
+        while mail_queue.depth() and time.perf_counter() < deadline:
+            time.sleep(0.2)
+        mail = mail_queue.stats()
+    sink.shutdown()
+
+    all_latencies = [value for values in recorder.routes.values() for value in values]
+    return {
+        'meta': {'commit': git_commit(), 'date': datetime.utcnow().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                 'cpus': os.cpu_count(), 'users': args.users, 'posts': args.posts,
+                 'vusers': args.vusers, 'duration': args.duration, 'mix': mix,
+                 'bcrypt_rounds': args.bcrypt_rounds, 'page_cache': not args.no_page_cache},
+        'total': dict(summarize(all_latencies, elapsed), errors=sum(recorder.errors.values())),
+        'actions': {name: summarize(values, elapsed) for name, values in sorted(recorder.actions.items())},
+        'routes': {label: dict(summarize(values, elapsed), errors=recorder.errors[label])
+                   for label, values in sorted(recorder.routes.items())},
+        'mail': {'sent_to_sink': sink.messages, 'queue': mail},
+    }
+
+
+def print_report(result, baseline=None):
+    """a table per route, with the change against the baseline run in brackets."""
+    def with_change(rows, name, key):
+        value = rows[name][key]
+        old = baseline and baseline_rows.get(name, {}).get(key)
+        return f'{value} ({(value - old) / old * 100:+.0f}%)' if old else f'{value}'
+
+    rows = dict(result['routes'], TOTAL=result['total'])
+    baseline_rows = dict(baseline['routes'], TOTAL=baseline['total']) if baseline else {}
+    print(f'{"route":<38} {"requests":>8} {"rps":>16} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>18} {"errors":>6}')
+    for name, data in rows.items():
+        print(f'{name:<38} {data["requests"]:>8} {with_change(rows, name, "rps"):>16} {data["p50_ms"]:>9} '
+              f'{data["p95_ms"]:>9} {with_change(rows, name, "p99_ms"):>18} {data["errors"]:>6}')
+    print(f'reset mails delivered to the SMTP sink: {result["mail"]["sent_to_sink"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000, help='1000 up to 10000000')
+    parser.add_argument('--db', help='database file to seed/reuse (default: a temp file)')
+    parser.add_argument('--vusers', type=int, default=8, help='concurrent virtual users (threads)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of recorded load')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of load before recording')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'action weights (default {DEFAULT_MIX})')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='cost of the hashes made during the run')
+    parser.add_argument('--no-page-cache', action='store_true', help='every page view reaches the database')
+    parser.add_argument('--output', help=f'result file (default: {RESULTS_DIR}/<commit>-<time>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='a result file of an earlier run')
+    args = parser.parse_args()
+    parse_mix(args.mix)
+
+    result = run(args)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f'{result["meta"]["commit"] or "nocommit"}-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f'result written to {output}')
+
+
+if __name__ == '__main__':
+    main()
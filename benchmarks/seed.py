@@ -0,0 +1,83 @@
+"""Fill a throw-away database with fake users and posts for the benchmarks.
+
+the benchmarks never touch site.db: bench_app() builds the app on a
+temporary sqlite file."""
+import itertools
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+# every seeded user can log in with this password
+PASSWORD = 'password'
+# bcrypt hash of PASSWORD with cost 4, computed once so seeding stays fast
+PASSWORD_HASH = '$2b$04$bGTHRTyqCkbusSEA5BlreOiz5qifeiNOWoarwBCgA8ktNHHw/90ye'
+
+WORDS = ('flask python blog post query index page cursor cache sqlite '
+         'template render author user picture email token reset login').split()
+_SYLLABLES = 'ka lo mi ne ru sa ti vo be da fe gi ho ju pe qu ri so tu xa'.split()
+
+
+def _make_vocabulary(size=20000):
+    # pronounceable fake words, used with a Zipf distribution below so that, like
+    # real text, a few words are everywhere and most words are rare
+    rng = random.Random(7)
+    vocabulary = list(WORDS)
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+VOCABULARY = _make_vocabulary()
+# word number k is picked with a weight of 1/k (Zipf's law)
+_CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def bench_app(path=None, **config):
+    """an app on a fresh sqlite file (a temp file by default), never site.db.
+    keyword arguments are extra settings on top of config.Config."""
+    from flaskblog import create_app
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix='flaskblog-bench-', suffix='.db')
+        os.close(fd)
+        os.remove(path)
+    config.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite:///' + os.path.abspath(path))
+    return create_app(config)
+
+
+def _text(rng, n_words):
+    return ' '.join(rng.choices(VOCABULARY, cum_weights=_CUM_WEIGHTS, k=n_words))
+
+
+def seed(db, n_users, n_posts, chunk=10000, rng_seed=42):
+    """insert n_users users and n_posts posts with executemany in chunks.
+    posts are spread over the last ~3 years and over all users."""
+    from flaskblog.models import User, Post, make_excerpt
+    rng = random.Random(rng_seed)
+    db.create_all()
+    users = [{'id': i, 'username': f'user{i}', 'email': f'user{i}@demo.com',
+              'image_file': 'default.jpg', 'password': PASSWORD_HASH}
+             for i in range(1, n_users + 1)]
+    for start in range(0, len(users), chunk):
+        db.session.execute(User.__table__.insert(), users[start:start + chunk])
+    db.session.commit()
+
+    now = datetime.utcnow()
+    for start in range(1, n_posts + 1, chunk):
+        rows = [{'id': i,
+                 'title': _text(rng, 5).title(),
+                 'content': _text(rng, rng.randint(40, 200)),
+                 'date_posted': now - timedelta(seconds=rng.randint(0, 3 * 365 * 86400)),
+                 'user_id': rng.randint(1, n_users),
+                 'author_image': 'default.jpg'}
+                for i in range(start, min(start + chunk, n_posts + 1))]
+        # the bulk insert skips the ORM events, fill the listing columns here
+        for row in rows:
+            row['excerpt'] = make_excerpt(row['content'])
+            row['author_name'] = f'user{row["user_id"]}'
+        db.session.execute(Post.__table__.insert(), rows)
+        db.session.commit()
@@ -0,0 +1,76 @@
+"""A tiny local SMTP server that accepts every message and throws it away.
+
+good enough to try the mail queue and the reset flow offline:
+    python -m flaskblog.benchmarks.smtp_sink --port 8025
+and set MAIL_SERVER = 'localhost', MAIL_PORT = 8025, MAIL_USE_TLS = False."""
+import argparse
+import socketserver
+import threading
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self._reply('220 localhost smtp sink')
+        in_data = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if in_data:
+                if line in (b'.\r\n', b'.\n'):
+                    in_data = False
+                    self.server.count_message()
+                    self._reply('250 OK')
+                continue
+            command = line[:4].upper()
+            if command in (b'HELO', b'EHLO'):
+                self._reply('250 localhost')
+            elif command == b'DATA':
+                in_data = True
+                self._reply('354 end data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self._reply('221 bye')
+                return
+            else:
+                # MAIL FROM, RCPT TO, RSET, NOOP ...
+                self._reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='localhost', port=0):
+        super().__init__((host, port), _SMTPHandler)
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count_message(self):
+        with self._lock:
+            self.messages += 1
+
+    def start(self):
+        """serve from a daemon thread, returns self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+    sink = SMTPSink(args.host, args.port)
+    print(f'SMTP sink listening on {args.host}:{sink.port}')
+    sink.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""Small helpers shared by the load benchmarks."""
+
+
+def percentile(sorted_values, pct):
+    """nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed):
+    """requests/sec and p50/p95/p99 (in ms) of a list of latencies in seconds."""
+    values = sorted(latencies)
+    return {'requests': len(values),
+            'rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2)}
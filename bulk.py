@@ -0,0 +1,205 @@
+"""Bulk export and import of the users and the posts.
+
+    flask export-data users users.jsonl
+    flask export-data posts posts.csv
+    flask import-data users users.jsonl
+    flask import-data posts posts.csv --batch 20000
+
+the format comes from the file extension (.csv, anything else is JSON lines)
+or from --format, '-' is stdin/stdout. Both directions stream: the export
+walks the table in id order a chunk at a time, the import reads one line at
+a time and writes --batch rows with one executemany per transaction, so
+memory doesn't grow with the size of the dump.
+
+the export contains the columns of the table (users with their password
+hash, so accounts survive a move). On import the ids are kept, the users
+must be imported before their posts. The post import skips the ORM: the
+listing indexes are dropped while loading and built once at the end, then
+the author columns are filled in and the search index is rebuilt."""
+import csv
+import json
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from flaskblog import db
+from flaskblog.migrations import upgrade_db
+
+USER_COLUMNS = ('id', 'username', 'email', 'image_file', 'password')
+POST_COLUMNS = ('id', 'title', 'date_posted', 'content', 'user_id')
+BATCH_SIZE = 10000
+
+
+def _table(kind):
+    from flaskblog.models import User, Post
+    return (User.__table__, USER_COLUMNS) if kind == 'users' else (Post.__table__, POST_COLUMNS)
+
+
+def _open(path, mode):
+    # '-' is stdin/stdout; newline='' because the csv module handles line endings itself
+    if path == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+# -- export -----------------------------------------------------------------
+
+def export_rows(connection, kind, out, fmt, chunk=BATCH_SIZE):
+    """write every row of the table to the file object `out`, returns the count."""
+    table, columns = _table(kind)
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+    count = 0
+    last_id = 0
+    while True:
+        # keyset walk over the primary key: every chunk is an index range scan
+        rows = connection.execute(table.select().with_only_columns(*[table.c[c] for c in columns])
+                                  .where(table.c.id > last_id).order_by(table.c.id).limit(chunk)).fetchall()
+        if not rows:
+            return count
+        for row in rows:
+            values = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+            if fmt == 'csv':
+                writer.writerow(values)
+            else:
+                out.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + '\n')
+        count += len(rows)
+        last_id = rows[-1][0]
+
+
+# -- import -----------------------------------------------------------------
+
+def read_records(lines, fmt):
+    """dicts from a JSON lines or csv file object, one at a time."""
+    if fmt == 'csv':
+        yield from csv.DictReader(lines)
+    else:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _user_row(record):
+    return {'id': int(record['id']) if record.get('id') else None,
+            'username': record['username'],
+            'email': record['email'],
+            'image_file': record.get('image_file') or 'default.jpg',
+            'password': record['password']}
+
+
+def _post_row(record):
+    from flaskblog.models import make_excerpt
+    date_posted = record.get('date_posted')
+    return {'id': int(record['id']) if record.get('id') else None,
+            'title': record['title'],
+            'date_posted': datetime.fromisoformat(date_posted.rstrip('Z')) if date_posted else datetime.utcnow(),
+            'content': record['content'],
+            'user_id': int(record['user_id']),
+            'excerpt': make_excerpt(record['content']),
+            # filled from the user table once everything is loaded
+            'author_name': '',
+            'author_image': 'default.jpg'}
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_rows(engine, kind, records, batch_size=BATCH_SIZE, progress=None, defer_indexes=True):
+    """insert the records, batch_size rows per transaction. returns the count."""
+    from flaskblog.search import reindex
+    table, _ = _table(kind)
+    make_row = _user_row if kind == 'users' else _post_row
+    # secondary indexes are cheaper to build once than to update row by row
+    indexes = list(table.indexes) if kind == 'posts' and defer_indexes else []
+    with engine.begin() as connection:
+        for index in indexes:
+            index.drop(connection, checkfirst=True)
+    count = 0
+    try:
+        for batch in _batches(records, batch_size):
+            rows = [make_row(record) for record in batch]
+            # rows without an id get one from SQLite, they need their own statement
+            with engine.begin() as connection:
+                with_id = [row for row in rows if row['id'] is not None]
+                without_id = [{k: v for k, v in row.items() if k != 'id'} for row in rows if row['id'] is None]
+                if with_id:
+                    connection.execute(table.insert(), with_id)
+                if without_id:
+                    connection.execute(table.insert(), without_id)
+            count += len(rows)
+            if progress:
+                progress(count)
+    finally:
+        with engine.begin() as connection:
+            for index in indexes:
+                index.create(connection, checkfirst=True)
+    if kind == 'posts':
+        with engine.begin() as connection:
+            connection.execute(text('UPDATE post SET (author_name, author_image) = '
+                                    '(SELECT username, image_file FROM user WHERE user.id = post.user_id) '
+                                    "WHERE author_name = ''"))
+            reindex(connection)
+    return count
+
+
+# -- commands ---------------------------------------------------------------
+
+KIND = click.Choice(['users', 'posts'])
+FORMAT = click.Choice(['jsonl', 'csv'])
+
+
+@click.command('export-data')
+@click.argument('kind', type=KIND)
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=FORMAT, help='default: from the file extension')
+@with_appcontext
+def export_data_command(kind, path, fmt):
+    """Stream every user or post to a JSON lines or csv file."""
+    fmt = detect_format(path, fmt)
+    start = time.perf_counter()
+    with _open(path, 'w') as out, db.engine.connect() as connection:
+        count = export_rows(connection, kind, out, fmt)
+    elapsed = time.perf_counter() - start
+    click.echo(f'Exported {count} {kind} in {elapsed:.1f}s ({count / elapsed:,.0f} rows/sec).', err=True)
+
+
+@click.command('import-data')
+@click.argument('kind', type=KIND)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=FORMAT, help='default: from the file extension')
+@click.option('--batch', 'batch_size', default=BATCH_SIZE, show_default=True, help='rows per transaction')
+@with_appcontext
+def import_data_command(kind, path, fmt, batch_size):
+    """Load users or posts from a JSON lines or csv file."""
+    fmt = detect_format(path, fmt)
+    start = time.perf_counter()
+
+    def progress(count):
+        if count % (batch_size * 10) == 0:
+            click.echo(f'  {count} rows ({count / (time.perf_counter() - start):,.0f} rows/sec)', err=True)
+
+    # a new database gets the schema and the current migration version,
+    # an older one is brought up to date first
+    upgrade_db()
+    with _open(path, 'r') as lines:
+        count = import_rows(db.engine, kind, read_records(lines, fmt), batch_size, progress)
+    elapsed = time.perf_counter() - start
+    click.echo(f'Imported {count} {kind} in {elapsed:.1f}s ({count / elapsed:,.0f} rows/sec).', err=True)
@@ -0,0 +1,377 @@
+"""Server-side cache of rendered pages for logged-out visitors.
+
+most visitors are anonymous readers, and for them home, post and user_posts
+look exactly the same, so we keep the rendered html for a while instead of
+querying SQLite and rendering Jinja on every hit.
+
+Invalidation works with tags: while a page is rendered the view tags it with
+what it shows ('home', 'post:<id>', 'author:<user id>' ...). Every tag has a
+version in the backend, the time it was last invalidated, and a cached page
+remembers the versions it was rendered with. invalidate('post:7') gives the
+tag a new version, so every page that showed post 7 (and only those) becomes
+a miss. A page whose tags were invalidated while it was being rendered may
+show the old data, so it is not stored at all.
+
+backends (PAGE_CACHE_TYPE): 'memory' (per process), 'filesystem' (shared by
+the workers of one machine) or 'redis' (needs the redis package). With
+'memory' an edit only invalidates the pages of the worker that handled it,
+the other workers serve their copy until PAGE_CACHE_TTL runs out; with
+several workers (gunicorn -w 4) use 'filesystem' or 'redis'. The versions
+are timestamps, so machines sharing a redis cache need synchronized clocks.
+
+the shared backends store JSON, never pickles: whoever can write to the cache
+directory or the redis server could otherwise run code in the app. The cache
+directory defaults to <instance folder>/cache and must belong to the user
+running the app, nobody else gets access to it."""
+import base64
+import functools
+import hashlib
+import inspect
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request, session, g, make_response
+from flask_login import current_user
+
+
+def _encode(value):
+    # json has no bytes (the body of a page)
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f'{type(value).__name__} can not be cached')
+
+
+def _decode(obj):
+    return base64.b64decode(obj['__bytes__']) if set(obj) == {'__bytes__'} else obj
+
+
+def dumps(value):
+    return json.dumps(value, default=_encode, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    return json.loads(data, object_hook=_decode)
+
+
+def default_cache_dir(app):
+    """where the filesystem backends of this app keep their files."""
+    return os.path.join(app.instance_path, 'cache')
+
+
+def private_directory(path):
+    """create `path` for the user running the app only (mode 0700). an existing
+    directory must belong to that user, any access of others is removed."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError(f'cache directory {path} is not a directory')
+    if hasattr(os, 'getuid'):
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f'cache directory {path} belongs to another user')
+        if info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+
+class MemoryBackend:
+    """LRU dict with a TTL per entry, shared by the threads of one process."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            # recently used entries move to the end, the oldest get evicted first
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileSystemBackend:
+    """one pickle file per key, so every worker on the machine shares it.
+    the file modification time is used as 'last used' for the LRU eviction."""
+
+    def __init__(self, directory, max_entries=1000):
+        self.directory = private_directory(directory)
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = loads(f.read())
+        except (OSError, ValueError, TypeError):
+            return None
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        # write to a temp file first so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(dumps([expires, value]))
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = os.listdir(self.directory)
+        if len(entries) <= self.max_entries:
+            return
+        paths = [os.path.join(self.directory, name) for name in entries]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(os.listdir(self.directory))
+
+
+class RedisBackend:
+    """any redis compatible server. LRU eviction is left to the server
+    (maxmemory-policy allkeys-lru), the TTL is set on every key."""
+
+    def __init__(self, url, prefix='flaskblog:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("the 'redis' cache type needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def __len__(self):
+        return self.client.dbsize()
+
+
+class Counters:
+    """named counters for stats(), safe to bump from any thread."""
+
+    def __init__(self, *names):
+        self._values = dict.fromkeys(names, 0)
+        self._lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self._values[name] += amount
+
+    def snapshot(self):
+        """the values at one moment, plus hit_ratio when there are hits and misses."""
+        with self._lock:
+            values = dict(self._values)
+        if 'hits' in values and 'misses' in values:
+            lookups = values['hits'] + values['misses']
+            values['hit_ratio'] = round(values['hits'] / lookups, 4) if lookups else 0.0
+        return values
+
+
+def make_backend(config, prefix, setting='PAGE_CACHE'):
+    """build the backend that the config asks for ('memory', 'filesystem' or 'redis').
+    setting is the start of the config keys: <setting>_TYPE, <setting>_MAX_ENTRIES ..."""
+    kind = config[f'{setting}_TYPE']
+    if kind == 'memory':
+        return MemoryBackend(config[f'{setting}_MAX_ENTRIES'])
+    if kind == 'filesystem':
+        directory = private_directory(config[f'{setting}_DIR'])
+        return FileSystemBackend(os.path.join(directory, prefix),
+                                 config[f'{setting}_MAX_ENTRIES'])
+    if kind == 'redis':
+        return RedisBackend(config[f'{setting}_REDIS_URL'], prefix=f'flaskblog:{prefix}:')
+    raise ValueError(f'Unknown {setting}_TYPE {kind!r}')
+
+
+class _PageCacheState:
+    """the backend, settings and counters of one app."""
+
+    def __init__(self, config):
+        self.enabled = config['PAGE_CACHE_ENABLED']
+        self.ttl = config['PAGE_CACHE_TTL']
+        self.backend = make_backend(config, 'pages')
+        self.counters = Counters('hits', 'misses', 'invalidations')
+
+
+class PageCache:
+    """the backend of every app is in app.extensions['page_cache'], the
+    methods work on the one of current_app."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_ENABLED', True)
+        app.config.setdefault('PAGE_CACHE_TYPE', 'memory')
+        app.config.setdefault('PAGE_CACHE_TTL', 60)
+        app.config.setdefault('PAGE_CACHE_MAX_ENTRIES', 1000)
+        app.config.setdefault('PAGE_CACHE_DIR', default_cache_dir(app))
+        app.config.setdefault('PAGE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        app.extensions['page_cache'] = _PageCacheState(app.config)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['page_cache']
+
+    # -- tags -----------------------------------------------------------
+
+    def tag(self, *tags):
+        """called from a view: the page being rendered shows these things."""
+        if 'page_cache_tags' in g:
+            g.page_cache_tags.update(tags)
+
+    def invalidate(self, *tags):
+        """every cached page that was tagged with one of these tags is dropped."""
+        state = self._state()
+        now = time.time()
+        for tag in tags:
+            state.backend.set('tag:' + tag, now)
+        state.counters.add('invalidations', len(tags))
+
+    @staticmethod
+    def _tag_versions(backend, tags, started):
+        """the versions of the tags, or None when one of them was invalidated
+        after `started` (the page may have been rendered from old data)."""
+        versions = {}
+        for tag in tags:
+            version = backend.get('tag:' + tag)
+            if not isinstance(version, float):
+                # new (or evicted) tag: any version works as long as it isn't
+                # one an older page was stored with
+                version = started
+                backend.set('tag:' + tag, version)
+            elif version > started:
+                return None
+            versions[tag] = version
+        return versions
+
+    @staticmethod
+    def _is_fresh(backend, versions):
+        return all(backend.get('tag:' + tag) == version
+                   for tag, version in versions.items())
+
+    # -- the view decorator ---------------------------------------------
+
+    def _cacheable_request(self):
+        """only anonymous GETs without pending flash messages look the same for everybody."""
+        return (self._state().enabled and request.method == 'GET'
+                and not session.get('_flashes')
+                and not current_user.is_authenticated)
+
+    def cached(self, view):
+        """works on plain views and on the async views of asgi.py. the async
+        ones do the backend I/O on the thread pool, not on the event loop."""
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                from flaskblog.async_db import run_sync
+                if not self._cacheable_request():
+                    return await view(*args, **kwargs)
+                response = await run_sync(self._lookup)
+                if response is not None:
+                    return response
+                tags, started = self._collect_tags()
+                return await run_sync(self._store, await view(*args, **kwargs), tags, started)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self._cacheable_request():
+                return view(*args, **kwargs)
+            response = self._lookup()
+            if response is not None:
+                return response
+            tags, started = self._collect_tags()
+            return self._store(view(*args, **kwargs), tags, started)
+        return wrapper
+
+    def _lookup(self):
+        """the cached response of this request, or None."""
+        state = self._state()
+        entry = state.backend.get('page:' + request.full_path)
+        if entry is not None and self._is_fresh(state.backend, entry['tags']):
+            state.counters.add('hits')
+            response = make_response(entry['body'], entry['status'])
+            response.content_type = entry['content_type']
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        state.counters.add('misses')
+        return None
+
+    @staticmethod
+    def _collect_tags():
+        """start collecting the tags of the page that is about to be rendered."""
+        g.page_cache_tags = set()
+        return g.page_cache_tags, time.time()
+
+    def _store(self, rv, tags, started):
+        state = self._state()
+        response = make_response(rv)
+        versions = None
+        if response.status_code == 200 and not response.direct_passthrough:
+            versions = self._tag_versions(state.backend, tags, started)
+        if versions is not None:
+            state.backend.set('page:' + request.full_path,
+                              {'body': response.get_data(),
+                               'status': response.status_code,
+                               'content_type': response.content_type,
+                               'tags': versions},
+                              ttl=state.ttl)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def stats(self):
+        state = self._state()
+        return dict(state.counters.snapshot(), entries=len(state.backend))
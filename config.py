@@ -0,0 +1,105 @@
+"""All the settings of the app in one place.
+
+create_app() loads Config by default. Every deployment can change a setting
+through an environment variable of the same name (or pass its own config
+class / dict to create_app), nothing has to be edited in the code."""
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+class Config:
+    """Secret-key will help our website to be protected from
+    from different attacks like CSRF attack which stands for
+    Cross-site forgery attack.
+    To generate a secret-key , open up terminal ...
+    start python .... import secrets ... secrets.token_hex(16)."""
+    SECRET_KEY = os.environ.get('SECRET_KEY', '5791628bb0b13ce0c676dfde280ba245')
+
+    """Database URI will help us to set a location for our database """
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    """DB_POOL_SIZE / DB_MAX_OVERFLOW size the connection pool of the engines
+    that have one (a SQLite file or a database server, not an in-memory
+    SQLite database); unset means SQLAlchemy's 5 + 10. see database.py"""
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', None)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', None)
+
+    """applied to every new SQLite connection (see database.py).
+    WAL lets readers go on while somebody writes, busy_timeout makes a writer
+    wait for the lock instead of failing with 'database is locked',
+    synchronous=NORMAL is safe with WAL and skips an fsync per commit, and
+    mmap_size reads the file through memory mapping instead of read() calls."""
+    SQLITE_PRAGMAS = {
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT', 5000),
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    }
+    # read-only views use their own pool, on DATABASE_READ_URL (a replica) if set
+    DB_READ_ROUTING = os.environ.get('DB_READ_ROUTING', '1') == '1'
+    DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+    # posts on one page of the home and user listings
+    POSTS_PER_PAGE = _env_int('POSTS_PER_PAGE', 5)
+
+    """BCRYPT_LOG_ROUNDS is the cost of every new hash, higher is slower but safer.
+    it can be set per environment, e.g. a low cost for development and tests.
+    the hashing itself runs on a pool of BCRYPT_POOL_WORKERS processes."""
+    BCRYPT_LOG_ROUNDS = _env_int('BCRYPT_LOG_ROUNDS', 12)
+    BCRYPT_POOL_WORKERS = _env_int('BCRYPT_POOL_WORKERS', os.cpu_count() or 1)
+
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
+    MAIL_PORT = _env_int('MAIL_PORT', 587)
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '1') == '1'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME', 'Jabiraziz430@gmail.com')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', 'Jabir@123')
+
+    """Rendered pages of anonymous visitors are cached for PAGE_CACHE_TTL seconds.
+    PAGE_CACHE_TYPE can be 'memory', 'filesystem' (PAGE_CACHE_DIR, by default
+    instance/cache, private to the user running the app) or 'redis'
+    (PAGE_CACHE_REDIS_URL) so that several workers can share one cache.
+    'memory' is per worker: with more than one worker an edit is only seen by
+    the others after PAGE_CACHE_TTL, so use 'filesystem' or 'redis' there."""
+    PAGE_CACHE_TYPE = os.environ.get('PAGE_CACHE_TYPE', 'memory')
+    PAGE_CACHE_TTL = _env_int('PAGE_CACHE_TTL', 60)
+    PAGE_CACHE_MAX_ENTRIES = _env_int('PAGE_CACHE_MAX_ENTRIES', 1000)
+    PAGE_CACHE_REDIS_URL = os.environ.get('PAGE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+    """the logged-in user is kept for IDENTITY_CACHE_TTL seconds, so load_user
+    doesn't query the user table on every request (see identity.py)"""
+    IDENTITY_CACHE_TYPE = os.environ.get('IDENTITY_CACHE_TYPE', 'memory')
+    IDENTITY_CACHE_TTL = _env_int('IDENTITY_CACHE_TTL', 30)
+    IDENTITY_CACHE_MAX_ENTRIES = _env_int('IDENTITY_CACHE_MAX_ENTRIES', 10000)
+    IDENTITY_CACHE_REDIS_URL = os.environ.get('IDENTITY_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+    """INSTRUMENTATION_ENABLED adds timing spans, a Server-Timing header and
+    /metrics (see instrumentation.py). Requests slower than
+    INSTRUMENTATION_SLOW_SECONDS get a profile in INSTRUMENTATION_PROFILE_DIR."""
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', '0') == '1'
+    INSTRUMENTATION_SLOW_SECONDS = float(os.environ.get('INSTRUMENTATION_SLOW_SECONDS', '0.5'))
+
+    """ASGI mode (asgi.py): the async views read through ASYNC_DATABASE_URL
+    (default: the read-only SQLite file through aiosqlite), every other view
+    runs on a pool of ASGI_THREADS threads."""
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ASYNC_DB_POOL_SIZE = _env_int('ASYNC_DB_POOL_SIZE', 10)
+    ASGI_THREADS = _env_int('ASGI_THREADS', 8)
+
+    """a reset token is valid for RESET_TOKEN_MAX_AGE seconds and only once.
+    the reset pages allow RESET_IP_BURST hits per client at once, refilled by
+    RESET_IP_PER_HOUR an hour, and the same per email address (see tokens.py)."""
+    RESET_TOKEN_STORE_TYPE = os.environ.get('RESET_TOKEN_STORE_TYPE', 'memory')
+    RESET_IP_BURST = _env_int('RESET_IP_BURST', 10)
+    RESET_IP_PER_HOUR = _env_int('RESET_IP_PER_HOUR', 30)
+    RESET_EMAIL_BURST = _env_int('RESET_EMAIL_BURST', 3)
+    RESET_EMAIL_PER_HOUR = _env_int('RESET_EMAIL_PER_HOUR', 6)
+
+    """behind a reverse proxy (nginx, a load balancer) every request comes from
+    the address of the proxy, so the limits per client above would count all
+    clients together. PROXY_FIX_X_FOR is the number of proxies in front of the
+    app that add to X-Forwarded-For, request.remote_addr is then the address of
+    the client. keep it 0 without a proxy, or clients can fake their address."""
+    PROXY_FIX_X_FOR = _env_int('PROXY_FIX_X_FOR', 0)
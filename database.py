@@ -0,0 +1,158 @@
+"""Engine setup that Flask-SQLAlchemy does not do on its own.
+
+the engine is created from the config the first time the database is used,
+so every setting (pool, PRAGMAs ...) can differ per deployment.
+
+Connection pools: SQLAlchemy gives a SQLite file a NullPool, a new
+connection (and a new round of PRAGMAs) for every checkout. Both engines
+here keep their SQLite connections in a QueuePool instead, sized by
+DB_POOL_SIZE / DB_MAX_OVERFLOW like the pool of a database server. Pooled
+connections to a server are checked (pool_pre_ping) before they are handed
+out, so one the server closed is replaced instead of failing the request.
+
+Read/write routing: views decorated with @read_only (home, post, user_posts,
+about, search and the api) run their queries on a separate 'read' engine with
+its own connection pool, everything else and every flush uses the normal
+engine. The read engine is DATABASE_READ_URL when a replica is configured,
+otherwise a read-only (mode=ro) connection to the same SQLite file. With WAL
+journaling readers never wait for the writer, so page views don't queue
+behind new_post/update_post. WAL is switched on by the write engine, which
+is always created (and connected) before the read engine."""
+import asyncio
+import functools
+import os
+from flask import current_app, g
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state, _ident_func
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+READ_BIND = 'read'
+# the PRAGMAs that work on a read-only connection, journal_mode = wal
+# would have to write to the file
+READ_ONLY_PRAGMAS = ('busy_timeout', 'mmap_size', 'cache_size')
+
+
+def is_read_only(url):
+    """a SQLite URI filename opened with mode=ro."""
+    return url.drivername.startswith('sqlite') and url.query.get('mode') == 'ro'
+
+
+def apply_pragmas(engine, pragmas, read_only=False):
+    """run PRAGMA name = value on every new connection of a SQLite engine.
+    read-only engines only get the READ_ONLY_PRAGMAS."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    if read_only:
+        pragmas = {name: value for name, value in pragmas.items() if name in READ_ONLY_PRAGMAS}
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def sqlite_read_only_uri(app, uri):
+    """the same SQLite file opened read-only, None for in-memory databases."""
+    url = make_url(uri)
+    if not url.drivername.startswith('sqlite') or url.database in (None, '', ':memory:'):
+        return None
+    path = url.database
+    if not os.path.isabs(path):
+        # same rule as Flask-SQLAlchemy: relative paths are relative to the app
+        path = os.path.join(app.root_path, path)
+    return f'sqlite:///file:{path}?mode=ro&uri=true'
+
+
+def read_only(view):
+    """the view only reads, so its queries may go to the read engine."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def session_scope():
+    """key of the current db.session: the asyncio task when running on an event
+    loop (the ASGI mode serves many requests on one thread), else the
+    greenlet/thread like Flask-SQLAlchemy does."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task if task is not None else _ident_func()
+
+
+class RoutingSession(SignallingSession):
+    # db.session.get_bind() (the scoped session) also passes bind=..., which
+    # Flask-SQLAlchemy's get_bind() doesn't take
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (g and g.get('db_read_only') and not self._flushing
+                and READ_BIND in (self.app.config.get('SQLALCHEMY_BINDS') or {})):
+            return get_state(self.app).db.get_engine(self.app, bind=READ_BIND)
+        return super().get_bind(mapper, clause)
+
+
+class BlogSQLAlchemy(SQLAlchemy):
+    def init_app(self, app):
+        app.config.setdefault('DB_READ_ROUTING', True)
+        app.config.setdefault('DATABASE_READ_URL', None)
+        app.config.setdefault('DB_POOL_SIZE', None)
+        app.config.setdefault('DB_MAX_OVERFLOW', None)
+        super().init_app(app)
+        if not app.config['DB_READ_ROUTING']:
+            return
+        read_uri = app.config['DATABASE_READ_URL'] or \
+            sqlite_read_only_uri(app, app.config['SQLALCHEMY_DATABASE_URI'])
+        if read_uri:
+            app.config['SQLALCHEMY_BINDS'] = dict(app.config['SQLALCHEMY_BINDS'] or {},
+                                                  **{READ_BIND: read_uri})
+
+    def get_engine(self, app=None, bind=None):
+        if bind == READ_BIND:
+            # the write engine first: its first connection switches the file to WAL
+            super().get_engine(app)
+        return super().get_engine(app, bind)
+
+    def create_scoped_session(self, options=None):
+        options = dict(options or {})
+        options.setdefault('scopefunc', session_scope)
+        return super().create_scoped_session(options)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        rv_url, options = super().apply_driver_hacks(app, sa_url, options)
+        # 'file:...' is a SQLite URI filename (the read-only connection), its
+        # path is already absolute and must not be prefixed with the app folder
+        if sa_url.drivername.startswith('sqlite') and (sa_url.database or '').startswith('file:'):
+            rv_url = sa_url
+        if sa_url.drivername.startswith('sqlite') and sa_url.database not in (None, '', ':memory:'):
+            # a pool instead of NullPool; a pooled connection is only ever used
+            # by one thread at a time, so it may move between threads
+            options['poolclass'] = QueuePool
+            options['connect_args'] = dict(options.get('connect_args') or {}, check_same_thread=False)
+        # the sizes only exist on a QueuePool (in-memory SQLite has a StaticPool)
+        poolclass = options.get('poolclass')
+        if poolclass is None or issubclass(poolclass, QueuePool):
+            if app.config['DB_POOL_SIZE'] is not None:
+                options['pool_size'] = app.config['DB_POOL_SIZE']
+            if app.config['DB_MAX_OVERFLOW'] is not None:
+                options['max_overflow'] = app.config['DB_MAX_OVERFLOW']
+            if not sa_url.drivername.startswith('sqlite'):
+                # a SQLite connection can't be closed from the other side
+                options['pool_pre_ping'] = True
+        return rv_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        read_only = is_read_only(sa_url)
+        apply_pragmas(engine, current_app.config.get('SQLITE_PRAGMAS'), read_only=read_only)
+        if engine.dialect.name == 'sqlite' and not read_only:
+            # run the PRAGMAs (journal_mode = wal) now, before any reader opens the file
+            engine.connect().close()
+        return engine
@@ -17,6 +17,12 @@ def error_403(error):
     return render_template('403.html'), 403
 
 
+# too many requests (the rate limit of the password reset pages)
+@errors.app_errorhandler(429)
+def error_429(error):
+    return render_template('429.html'), 429
+
+
 # error 500: means something has gone wrong on the web site's server (Generall server error)
 @errors.app_errorhandler(500)
 def error_500(error):
@@ -9,9 +9,17 @@ from flask_login import current_user
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField
 # Validators will help us to apply some limitation over specific field
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
+from flaskblog.hashing import MAX_PASSWORD_BYTES
 from flaskblog.models import User
 
 
+def password_length(form, field):
+    """bcrypt works on bytes, so a password with accents or emoji may be
+    refused before it has MAX_PASSWORD_BYTES characters."""
+    if field.data and len(field.data.encode('utf-8')) > MAX_PASSWORD_BYTES:
+        raise ValidationError(f'Password must be at most {MAX_PASSWORD_BYTES} bytes long.')
+
+
 class RegistrationForm(FlaskForm):
     # DataRequired() means that this field cannot be empty
 
@@ -20,7 +28,7 @@ class RegistrationForm(FlaskForm):
                            validators=[DataRequired(), Length(min=2, max=20)])
     email = StringField('Email',
                         validators=[DataRequired(), Email()])
-    password = PasswordField('Password', validators=[DataRequired()])
+    password = PasswordField('Password', validators=[DataRequired(), password_length])
 
     """EqualTo() here means that the confirm password must be same as password field.
        Also the word 'password' used in Equalto() method is the name of the field not
@@ -98,7 +106,7 @@ class RequestResetForm(FlaskForm):
 
 
 class ResetPasswordForm(FlaskForm):
-    password = PasswordField('Password', validators=[DataRequired()])
+    password = PasswordField('Password', validators=[DataRequired(), password_length])
     confirm_password = PasswordField('Confirm Password',
                                      validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('Reset Password')
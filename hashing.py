@@ -0,0 +1,110 @@
+"""Password hashing on a process pool.
+
+bcrypt is slow on purpose, a single hash with cost 12 takes a few hundred ms of
+pure CPU. Doing that inside the request blocks the worker, and with threads the
+hashes fight over the same core. PasswordHasher sends the work to a fixed size
+pool of processes instead, so a login burst uses every core and the number of
+hashes running at the same time is bounded.
+
+config:
+    BCRYPT_LOG_ROUNDS    cost factor of new hashes
+    BCRYPT_POOL_WORKERS  processes in the pool, 0 hashes inline (tests, debugging)
+    BCRYPT_POOL_TIMEOUT  seconds a request waits for its hash before giving up"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import current_app
+from flaskblog.instrumentation import span
+
+# bcrypt refuses longer passwords (older versions silently cut them), the
+# forms reject them before they get here
+MAX_PASSWORD_BYTES = 72
+
+
+# these two run inside the pool processes, so they must stay plain functions
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(pw_hash, password):
+    try:
+        return bcrypt.checkpw(password, pw_hash)
+    except ValueError:
+        # not a bcrypt hash at all, or a password longer than MAX_PASSWORD_BYTES
+        return False
+
+
+def hash_rounds(pw_hash):
+    """the cost factor stored in a hash like $2b$12$..., or None."""
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class _HasherState:
+    """the settings and the process pool of one app."""
+
+    def __init__(self, config):
+        self.rounds = config['BCRYPT_LOG_ROUNDS']
+        self.workers = config['BCRYPT_POOL_WORKERS']
+        self.timeout = config['BCRYPT_POOL_TIMEOUT']
+        self.pool = None
+        self.lock = threading.Lock()
+
+
+class PasswordHasher:
+    """the settings live in app.extensions['password_hasher'], so every app
+    (tests, several configs in one process) hashes with its own cost."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('BCRYPT_POOL_WORKERS', os.cpu_count() or 1)
+        app.config.setdefault('BCRYPT_POOL_TIMEOUT', 30)
+        app.extensions['password_hasher'] = _HasherState(app.config)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['password_hasher']
+
+    @property
+    def rounds(self):
+        """cost factor of new hashes in the current app."""
+        return self._state().rounds
+
+    def _run(self, func, *args):
+        with span('bcrypt'):
+            return self._call(self._state(), func, *args)
+
+    @staticmethod
+    def _call(state, func, *args):
+        if not state.workers:
+            return func(*args)
+        # started on first use, in each worker (see wsgi.py)
+        if state.pool is None:
+            with state.lock:
+                if state.pool is None:
+                    state.pool = ProcessPoolExecutor(max_workers=state.workers)
+        return state.pool.submit(func, *args).result(timeout=state.timeout)
+
+    def generate_password_hash(self, password):
+        return self._run(_hash_password, password.encode('utf-8'), self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._run(_check_password, pw_hash.encode('utf-8'), password.encode('utf-8'))
+
+    def needs_rehash(self, pw_hash):
+        """True when the hash was made with a different cost than the configured one."""
+        return hash_rounds(pw_hash) != self.rounds
+
+    def shutdown(self):
+        """stop the pool of the current app."""
+        state = self._state()
+        if state.pool is not None:
+            state.pool.shutdown()
+            state.pool = None
@@ -0,0 +1,91 @@
+"""Cache of the logged-in user, so load_user doesn't query the database on
+every request of a logged-in visitor.
+
+the cache holds the plain column values of the user (not the password hash)
+for IDENTITY_CACHE_TTL seconds. On a hit the User is rebuilt from them and
+merged into the session with load=False, which attaches it without a SELECT;
+changes to current_user (account()) are still saved normally.
+account() and the avatar worker call forget() after they change a user,
+the short TTL covers anything else. The password is never cached, so a
+password change doesn't need it.
+
+IDENTITY_CACHE_TYPE is 'memory' (per process) or 'redis'/'filesystem' to share
+it between the workers, the backends are the ones of the page cache."""
+from flask import current_app, g
+from sqlalchemy.orm import make_transient_to_detached
+from flaskblog.cache import Counters, default_cache_dir, make_backend
+
+# everything current_user needs, the password is loaded only if it is used
+CACHED_COLUMNS = ('id', 'username', 'email', 'image_file')
+
+
+class _IdentityCacheState:
+    """the backend, settings and counters of one app."""
+
+    def __init__(self, config):
+        self.enabled = config['IDENTITY_CACHE_ENABLED']
+        self.ttl = config['IDENTITY_CACHE_TTL']
+        self.backend = make_backend(config, 'identity', setting='IDENTITY_CACHE')
+        self.counters = Counters('hits', 'misses', 'requests')
+
+
+class IdentityCache:
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('IDENTITY_CACHE_ENABLED', True)
+        app.config.setdefault('IDENTITY_CACHE_TYPE', 'memory')
+        app.config.setdefault('IDENTITY_CACHE_TTL', 30)
+        app.config.setdefault('IDENTITY_CACHE_MAX_ENTRIES', 10000)
+        app.config.setdefault('IDENTITY_CACHE_DIR', default_cache_dir(app))
+        app.config.setdefault('IDENTITY_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        self.db = db
+        app.extensions['identity_cache'] = _IdentityCacheState(app.config)
+        app.after_request(self._count_request)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['identity_cache']
+
+    def load(self, user_id):
+        """the User with this id (or None), from the cache when possible."""
+        from flaskblog.models import User
+        state = self._state()
+        key = f'user:{user_id}'
+        g.identity_cache_used = True
+        row = state.backend.get(key) if state.enabled else None
+        if row is not None:
+            state.counters.add('hits')
+            user = User(**row)
+            # a detached object with clean history, merge() can attach it without a query
+            make_transient_to_detached(user)
+            return self.db.session.merge(user, load=False)
+        state.counters.add('misses')
+        user = User.query.get(user_id)
+        if user is not None and state.enabled:
+            state.backend.set(key, {column: getattr(user, column) for column in CACHED_COLUMNS},
+                              ttl=state.ttl)
+        return user
+
+    def forget(self, user_id):
+        """call after changing a user."""
+        self._state().backend.delete(f'user:{user_id}')
+
+    def _count_request(self, response):
+        # requests that looked up the logged-in user
+        if g.get('identity_cache_used'):
+            self._state().counters.add('requests')
+        return response
+
+    def stats(self):
+        state = self._state()
+        stats = state.counters.snapshot()
+        hits, requests = stats['hits'], stats['requests']
+        # every hit is one SELECT on the user table that did not happen
+        stats['saved_round_trips'] = hits
+        stats['saved_per_request'] = round(hits / requests, 4) if requests else 0.0
+        stats['entries'] = len(state.backend)
+        return stats
@@ -0,0 +1,227 @@
+"""Profile pictures are resized in the background.
+
+decoding a big upload and shrinking it takes a while, so account() only hands
+the uploaded bytes to a small pool of worker threads (Pillow releases the GIL
+while it decodes, resizes and encodes). The worker renders every size in
+AVATAR_SIZES as WebP and JPEG, then points the user at the new picture and
+deletes the files of the old one when no other user has it.
+
+For JPEG uploads Image.draft() lets the decoder produce a smaller image right
+away (1/2, 1/4 or 1/8 scale), so a huge photo is never decoded at full size.
+
+file names: a picture is named after the sha256 of the uploaded bytes, 'ab12'
+is stored as ab12_32.jpg, ab12_32.webp, ab12_64.jpg ... and User.image_file
+holds just 'ab12'. The same upload always gets the same name, so it is stored
+only once no matter how many users pick it, and the files never change, which
+lets static_cache.py serve them with an immutable Cache-Control.
+Older pictures (and default.jpg) are a single file and keep their extension
+in image_file."""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from flaskblog.instrumentation import span
+
+AVATAR_SIZES = (32, 64, 128, 256)
+# (file extension, Pillow format, save options)
+AVATAR_FORMATS = (('webp', 'WEBP', {'quality': 80, 'method': 4}),
+                  ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}))
+DEFAULT_PICTURE = 'default.jpg'
+
+
+def content_name(data):
+    """16 hex chars of the sha256 of the upload (fits into User.image_file)."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def has_variants(image_file):
+    """new style pictures have no extension and come in several sizes."""
+    return '.' not in image_file
+
+
+def pick_size(size):
+    """the smallest stored size that is at least `size` pixels."""
+    for stored in AVATAR_SIZES:
+        if stored >= size:
+            return stored
+    return AVATAR_SIZES[-1]
+
+
+def avatar_filename(image_file, size, ext='jpg'):
+    """path (relative to static) of the picture in the wanted size and format,
+    old single-file pictures are returned as they are."""
+    if not has_variants(image_file):
+        return 'profile_pics/' + image_file
+    return f'profile_pics/{image_file}_{pick_size(size)}.{ext}'
+
+
+def variant_names(image_file):
+    return [f'{image_file}_{size}.{ext}' for size in AVATAR_SIZES for ext, _, _ in AVATAR_FORMATS]
+
+
+class _AvatarState:
+    """the worker threads of one app."""
+
+    def __init__(self):
+        self.pool = None
+        self.lock = threading.Lock()
+
+
+class AvatarProcessor:
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('IMAGE_POOL_WORKERS', 2)
+        app.config.setdefault('PROFILE_PICS_DIR', os.path.join(app.root_path, 'static', 'profile_pics'))
+        self.db = db
+        app.extensions['avatars'] = _AvatarState()
+        app.jinja_env.globals['avatar_filename'] = avatar_filename
+        app.jinja_env.globals['has_variants'] = has_variants
+
+    @property
+    def directory(self):
+        return current_app.config['PROFILE_PICS_DIR']
+
+    def _executor(self):
+        state = current_app.extensions['avatars']
+        # started on first upload, in each worker (see wsgi.py)
+        if state.pool is None:
+            with state.lock:
+                if state.pool is None:
+                    state.pool = ThreadPoolExecutor(max_workers=current_app.config['IMAGE_POOL_WORKERS'],
+                                                    thread_name_prefix='avatars')
+        return state.pool
+
+    def submit(self, user_id, form_picture):
+        """queue an uploaded picture (a FileStorage) for the user, returns the future."""
+        with span('upload'):
+            data = form_picture.read()
+        return self._executor().submit(self._process, current_app._get_current_object(), user_id, data)
+
+    # -- runs on the worker threads -------------------------------------
+
+    def render(self, data, name):
+        """write every size/format of the picture `name` from the uploaded bytes.
+
+        every file is rendered into a temp file of its own first and only
+        published when all of them are done, so a broken upload leaves nothing
+        behind. two jobs may render the same picture at once (the same upload
+        twice): whoever publishes a file first wins, the other one keeps the
+        existing file (it has the same content) and never removes it."""
+        from PIL import Image, ImageOps
+        largest = AVATAR_SIZES[-1]
+        img = Image.open(io.BytesIO(data))
+        # JPEG only: decode at a reduced scale that is still >= the largest size
+        img.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        rendered = []
+        try:
+            # biggest first, every smaller size is shrunk from the previous one
+            for size in sorted(AVATAR_SIZES, reverse=True):
+                img.thumbnail((size, size))
+                for ext, fmt, options in AVATAR_FORMATS:
+                    fd, tmp = tempfile.mkstemp(prefix=f'{name}_{size}.', suffix='.tmp', dir=self.directory)
+                    rendered.append((tmp, os.path.join(self.directory, f'{name}_{size}.{ext}')))
+                    # mkstemp makes the file private, the pictures are public
+                    os.chmod(tmp, 0o644)
+                    with os.fdopen(fd, 'wb') as f:
+                        img.save(f, fmt, **options)
+            self._publish(rendered)
+        finally:
+            for tmp, _ in rendered:
+                _remove(tmp)
+
+    @staticmethod
+    def _publish(rendered):
+        """give the temp files their real names. os.link() fails when the name
+        exists, so only files this job created are removed when it fails."""
+        created = []
+        try:
+            for tmp, path in rendered:
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    continue
+                created.append(path)
+        except OSError:
+            for path in created:
+                _remove(path)
+            raise
+
+    def _exists(self, name):
+        return all(os.path.exists(os.path.join(self.directory, filename))
+                   for filename in variant_names(name))
+
+    def _process(self, app, user_id, data):
+        with app.app_context():
+            name = content_name(data)
+            # the files can be deleted as unused between the _exists() check and the
+            # switch, _switch() notices that and the picture is rendered again
+            for _ in range(3):
+                # somebody uploaded exactly this picture before, the files are already there
+                if not self._exists(name):
+                    try:
+                        with span('pil'):
+                            self.render(data, name)
+                    except Exception:
+                        app.logger.exception('could not process the picture of user %s', user_id)
+                        return None
+                switched = self._switch(user_id, name)
+                if switched is not False:
+                    return switched
+            app.logger.error('the picture of user %s kept disappearing', user_id)
+            return None
+
+    def _switch(self, user_id, name):
+        """point the user at the picture `name` and delete the old picture if
+        nobody uses it anymore. False when the files of `name` are gone.
+
+        the UPDATE of the user takes the write lock of the database. While it
+        is held no other job can switch a user (and start using a picture), so
+        the check that the new picture is still there and the check that the
+        old one is unused can't be overtaken by another upload."""
+        from flaskblog.models import User
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        old = user.image_file
+        if old == name:
+            return name
+        user.image_file = name
+        self.db.session.flush()
+        if not self._exists(name):
+            self.db.session.rollback()
+            return False
+        # pictures are shared between users now, only delete unused ones
+        if User.query.filter_by(image_file=old).count() == 0:
+            self.delete_picture(old)
+        self.db.session.commit()
+        from flaskblog import page_cache, identity_cache
+        if 'page_cache' in current_app.extensions:
+            page_cache.invalidate(f'author:{user_id}')
+        if 'identity_cache' in current_app.extensions:
+            identity_cache.forget(user_id)
+        return name
+
+    def delete_picture(self, image_file):
+        """remove the files of a picture that nobody uses anymore."""
+        if not image_file or image_file == DEFAULT_PICTURE:
+            return
+        names = variant_names(image_file) if has_variants(image_file) else [image_file]
+        for filename in names:
+            _remove(os.path.join(self.directory, filename))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,341 @@
+"""Opt-in timing of where a request spends its time.
+
+turned on with INSTRUMENTATION_ENABLED. Then every request gets:
+
+- spans: time spent in each phase. SQL comes from the SQLAlchemy cursor events
+  (number of queries and their total time), template rendering from Flask's
+  template signals, and the code that does slow work wraps it in
+  `with span('bcrypt'):` (hashing.py, images.py, mailqueue.py). span() does
+  nothing when instrumentation is off.
+- a Server-Timing header with the spans, so the browser dev tools show them:
+  Server-Timing: sql;dur=3.1;desc="4 queries", render;dur=5.2, app;dur=11.0
+- Prometheus histograms of the latency per route and of every phase, served
+  as text on INSTRUMENTATION_METRICS_PATH (/metrics). They are per process.
+- a sampling profiler: a background thread looks at the stack of every
+  running request each INSTRUMENTATION_PROFILE_INTERVAL seconds. Requests
+  slower than INSTRUMENTATION_SLOW_SECONDS get their stacks written to
+  INSTRUMENTATION_PROFILE_DIR in the folded format that flamegraph.pl and
+  speedscope read (`frame;frame;frame count` per line)."""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, request, has_app_context, has_request_context, Response
+from flask.signals import signals_available, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """a Prometheus histogram: cumulative bucket counts, sum and count per label set."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+                prefix = label_text + ',' if label_text else ''
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {total:.6f}')
+                lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+                lines.append(f'{self.name}{{{label_text}}} {value:g}')
+        return lines
+
+
+def _folded_stack(frame):
+    """root first, e.g. 'app.py:wsgi_app;routes.py:home;models.py:__repr__'."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _running_request():
+    """(key, thread id, task) of the code that is running: the asyncio task on
+    an event loop (the ASGI mode serves many requests on one thread, like
+    database.session_scope), else the thread."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    thread_id = threading.get_ident()
+    return (task if task is not None else thread_id), thread_id, task
+
+
+class SamplingProfiler:
+    """samples the stacks of the threads (or asyncio tasks) that are serving a
+    request. a task is only sampled while it runs, not while it awaits."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """start sampling the request that is running."""
+        key, thread_id, task = _running_request()
+        with self._lock:
+            self._active[key] = (thread_id, task, Counter())
+            if self._thread is None or not self._thread.is_alive():
+                # started on first use, in each worker (see wsgi.py)
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """the samples taken while the running request ran."""
+        with self._lock:
+            entry = self._active.pop(_running_request()[0], None)
+        return entry[2] if entry is not None else None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, task, stacks in self._active.values():
+                    # the event loop thread runs one task at a time, the
+                    # sample belongs to the one that is running now
+                    if task is not None and asyncio.current_task(task.get_loop()) is not task:
+                        continue
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_folded_stack(frame)] += 1
+
+
+class _InstrumentationState:
+    """the metrics and the profiler of one app."""
+
+    def __init__(self, config):
+        self.enabled = config['INSTRUMENTATION_ENABLED']
+        self.profiler = None
+        if self.enabled and config['INSTRUMENTATION_SLOW_SECONDS']:
+            self.profiler = SamplingProfiler(config['INSTRUMENTATION_PROFILE_INTERVAL'])
+        self.request_latency = Histogram('flaskblog_request_duration_seconds',
+                                         'Time to handle a request.', ('endpoint', 'method', 'status'))
+        self.phase_latency = Histogram('flaskblog_phase_duration_seconds',
+                                       'Time spent in one phase (span) of the work.', ('phase',))
+        self.sql_queries = CounterMetric('flaskblog_sql_queries_total',
+                                         'SQL statements executed.', ('endpoint',))
+        self.sql_seconds = CounterMetric('flaskblog_sql_duration_seconds_total',
+                                         'Time spent executing SQL statements.', ('endpoint',))
+        self.slow_requests = CounterMetric('flaskblog_slow_requests_total',
+                                           'Requests slower than INSTRUMENTATION_SLOW_SECONDS.', ('endpoint',))
+
+    def record_span(self, name, seconds):
+        self.phase_latency.observe((name,), seconds)
+        if has_request_context() and 'instrumentation' in g:
+            spans = g.instrumentation['spans']
+            spans[name] = spans.get(name, 0.0) + seconds
+
+
+class Instrumentation:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENTATION_ENABLED', False)
+        app.config.setdefault('INSTRUMENTATION_SERVER_TIMING', True)
+        app.config.setdefault('INSTRUMENTATION_METRICS_PATH', '/metrics')
+        app.config.setdefault('INSTRUMENTATION_SLOW_SECONDS', 0.5)
+        app.config.setdefault('INSTRUMENTATION_PROFILE_INTERVAL', 0.005)
+        app.config.setdefault('INSTRUMENTATION_PROFILE_DIR',
+                              os.path.join(tempfile.gettempdir(), 'flaskblog-profiles'))
+        app.extensions['instrumentation'] = _InstrumentationState(app.config)
+        if not app.config['INSTRUMENTATION_ENABLED']:
+            return
+
+        _listen_to_sql()
+        if signals_available:
+            before_render_template.connect(_render_started, app)
+            template_rendered.connect(_render_finished, app)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        if app.config['INSTRUMENTATION_METRICS_PATH']:
+            app.add_url_rule(app.config['INSTRUMENTATION_METRICS_PATH'], 'metrics', self.metrics_view)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['instrumentation']
+
+    @property
+    def enabled(self):
+        return self._state().enabled
+
+    # -- per request ----------------------------------------------------
+
+    def _start_request(self):
+        g.instrumentation = {'start': time.perf_counter(), 'spans': {},
+                             'sql_count': 0, 'sql_seconds': 0.0}
+        profiler = self._state().profiler
+        if profiler is not None:
+            profiler.start()
+
+    def _finish_request(self, response):
+        state = g.pop('instrumentation', None)
+        if state is None or request.endpoint == 'metrics':
+            return response
+        metrics = self._state()
+        elapsed = time.perf_counter() - state['start']
+        endpoint = request.endpoint or 'none'
+        metrics.request_latency.observe((endpoint, request.method, str(response.status_code)), elapsed)
+        metrics.sql_queries.inc((endpoint,), state['sql_count'])
+        metrics.sql_seconds.inc((endpoint,), state['sql_seconds'])
+
+        if current_app.config['INSTRUMENTATION_SERVER_TIMING']:
+            timings = [f'sql;dur={state["sql_seconds"] * 1000:.1f};desc="{state["sql_count"]} queries"']
+            timings += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in state['spans'].items()]
+            timings.append(f'app;dur={elapsed * 1000:.1f}')
+            response.headers['Server-Timing'] = ', '.join(timings)
+
+        if metrics.profiler is not None:
+            stacks = metrics.profiler.stop()
+            if stacks and elapsed >= current_app.config['INSTRUMENTATION_SLOW_SECONDS']:
+                metrics.slow_requests.inc((endpoint,))
+                self._dump_profile(endpoint, elapsed, stacks)
+        return response
+
+    def _teardown_request(self, exc):
+        # the request failed before after_request, don't keep sampling this thread
+        profiler = self._state().profiler
+        if profiler is not None:
+            profiler.stop()
+
+    def _dump_profile(self, endpoint, elapsed, stacks):
+        directory = current_app.config['INSTRUMENTATION_PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-'
+                                       f'{int(elapsed * 1000)}ms-{id(stacks):x}.folded')
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        current_app.logger.warning('slow request %s %s (%.0f ms), profile written to %s',
+                                   request.method, request.path, elapsed * 1000, path)
+
+    # -- /metrics -------------------------------------------------------
+
+    def metrics_view(self):
+        state = self._state()
+        lines = []
+        for metric in (state.request_latency, state.phase_latency, state.sql_queries,
+                       state.sql_seconds, state.slow_requests):
+            lines += metric.render()
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def _current(app=None):
+    if app is None:
+        if not has_app_context():
+            return None
+        app = current_app
+    state = app.extensions.get('instrumentation')
+    return state if state is not None and state.enabled else None
+
+
+@contextmanager
+def span(name, app=None):
+    """time the block as the phase `name`. app is needed outside an app context
+    (worker threads)."""
+    state = _current(app)
+    if state is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        state.record_span(name, time.perf_counter() - start)
+
+
+# -- SQL and template hooks ---------------------------------------------
+
+_sql_listening = False
+
+
+def _listen_to_sql():
+    # on the Engine class, so every engine (write, read, created later) is covered
+    global _sql_listening
+    if _sql_listening:
+        return
+    _sql_listening = True
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('instrumentation_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('instrumentation_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context() and 'instrumentation' in g:
+        g.instrumentation['sql_count'] += 1
+        g.instrumentation['sql_seconds'] += elapsed
+
+
+def _render_started(app, template, context, **extra):
+    if 'instrumentation' in g:
+        g.instrumentation.setdefault('render_starts', []).append(time.perf_counter())
+
+
+def _render_finished(app, template, context, **extra):
+    if 'instrumentation' in g and g.instrumentation.get('render_starts'):
+        elapsed = time.perf_counter() - g.instrumentation['render_starts'].pop()
+        app.extensions['instrumentation'].record_span('render', elapsed)
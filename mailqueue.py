@@ -0,0 +1,225 @@
+"""Background delivery of emails.
+
+mail.send() opens a new SMTP connection (handshake + TLS) for every message and
+the request has to wait for all of it. Instead the request only stores the
+message in the QueuedMail table and returns. A background thread picks up the
+waiting messages in batches, sends a whole batch over one SMTP connection and
+retries failed messages later with exponential backoff. Because the outbox is a
+table, nothing is lost when the process restarts.
+
+config:
+    MAIL_QUEUE_BATCH_SIZE     messages sent over one SMTP connection
+    MAIL_QUEUE_POLL_INTERVAL  seconds the worker sleeps when the outbox is empty
+    MAIL_QUEUE_MAX_ATTEMPTS   a message is dropped after this many failures
+    MAIL_QUEUE_BACKOFF        seconds before the first retry, doubled every time
+    MAIL_QUEUE_CLAIM_TIMEOUT  seconds a worker owns the messages it picked
+    MAIL_QUEUE_WORKER         start the background thread (False: use flask send-mail)"""
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import or_
+from flaskblog.instrumentation import span
+
+
+class _MailQueueState:
+    """the Mail instance, the worker thread and the counters of one app."""
+
+    def __init__(self, app):
+        self.app = app
+        self.mail = None
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_latency = None
+        self.latency_total = 0.0
+        self.last_batch_seconds = None
+
+
+class MailQueue:
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_QUEUE_POLL_INTERVAL', 5)
+        app.config.setdefault('MAIL_QUEUE_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_QUEUE_BACKOFF', 30)
+        app.config.setdefault('MAIL_QUEUE_CLAIM_TIMEOUT', 300)
+        app.config.setdefault('MAIL_QUEUE_WORKER', True)
+        self.db = db
+        # every app sends with its own settings and has its own worker
+        app.extensions['mail_queue'] = _MailQueueState(app)
+        app.cli.command('send-mail')(self._send_mail_command)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['mail_queue']
+
+    @property
+    def mail(self):
+        """Flask-Mail is only imported once the first batch is sent, so the
+        server workers (and the cli) don't pay for it at startup."""
+        state = self._state()
+        if state.mail is None:
+            from flask_mail import Mail
+            state.mail = Mail(state.app)
+        return state.mail
+
+    # -- request side ---------------------------------------------------
+
+    def enqueue(self, msg):
+        """store a flask_mail.Message in the outbox; returns right away."""
+        from flaskblog.models import QueuedMail
+        state = self._state()
+        queued = QueuedMail(subject=msg.subject, sender=msg.sender,
+                            recipients=','.join(msg.recipients), body=msg.body)
+        with span('mail'):
+            self.db.session.add(queued)
+            self.db.session.commit()
+        with state.lock:
+            state.enqueued += 1
+        if state.app.config['MAIL_QUEUE_WORKER']:
+            self._ensure_worker(state)
+            state.wakeup.set()
+        return queued
+
+    def _ensure_worker(self, state):
+        # started on first use, in each worker (see wsgi.py)
+        if state.thread is not None and state.thread.is_alive():
+            return
+        with state.lock:
+            if state.thread is None or not state.thread.is_alive():
+                state.thread = threading.Thread(target=self._run, args=(state,), name='mail-queue', daemon=True)
+                state.thread.start()
+
+    # -- worker side ----------------------------------------------------
+
+    def _run(self, state):
+        app = state.app
+        interval = app.config['MAIL_QUEUE_POLL_INTERVAL']
+        while True:
+            try:
+                with app.app_context():
+                    sent_any = self.deliver_batch()
+            except Exception:
+                app.logger.exception('mail queue worker failed')
+                sent_any = False
+            if not sent_any:
+                state.wakeup.wait(interval)
+                state.wakeup.clear()
+
+    def _claim_batch(self):
+        """pick the due messages and mark them as ours, so that the workers of
+        other processes skip them."""
+        from flaskblog.models import QueuedMail
+        now = datetime.utcnow()
+        config = current_app.config
+        candidates = QueuedMail.query \
+            .filter(QueuedMail.next_attempt_at <= now) \
+            .filter(or_(QueuedMail.claimed_until.is_(None), QueuedMail.claimed_until < now)) \
+            .order_by(QueuedMail.id) \
+            .limit(config['MAIL_QUEUE_BATCH_SIZE']).all()
+        claimed = []
+        until = now + timedelta(seconds=config['MAIL_QUEUE_CLAIM_TIMEOUT'])
+        for queued in candidates:
+            rows = QueuedMail.query \
+                .filter(QueuedMail.id == queued.id) \
+                .filter(or_(QueuedMail.claimed_until.is_(None), QueuedMail.claimed_until < now)) \
+                .update({'claimed_until': until}, synchronize_session=False)
+            if rows:
+                claimed.append(queued)
+        self.db.session.commit()
+        return claimed
+
+    def deliver_batch(self):
+        """send one batch over a single SMTP connection. returns True if there was anything to send."""
+        from flask_mail import Message
+        state = self._state()
+        batch = self._claim_batch()
+        if not batch:
+            return False
+        start = time.perf_counter()
+        done = set()
+        try:
+            with span('smtp'), self.mail.connect() as conn:
+                for queued in batch:
+                    msg = Message(queued.subject, sender=queued.sender,
+                                  recipients=queued.recipients.split(','), body=queued.body)
+                    try:
+                        conn.send(msg)
+                    except Exception as e:
+                        self._failed(state, queued, e)
+                    else:
+                        self._sent(state, queued)
+                    done.add(queued.id)
+        except Exception as e:
+            # could not connect (or the connection dropped), the rest is retried later
+            for queued in batch:
+                if queued.id not in done:
+                    self._failed(state, queued, e)
+        self.db.session.commit()
+        with state.lock:
+            state.last_batch_seconds = time.perf_counter() - start
+        return True
+
+    def _sent(self, state, queued):
+        latency = (datetime.utcnow() - queued.created_at).total_seconds()
+        self.db.session.delete(queued)
+        with state.lock:
+            state.sent += 1
+            state.last_latency = latency
+            state.latency_total += latency
+
+    def _failed(self, state, queued, error):
+        config = state.app.config
+        queued.attempts += 1
+        queued.last_error = repr(error)
+        queued.claimed_until = None
+        with state.lock:
+            state.failed += 1
+        if queued.attempts >= config['MAIL_QUEUE_MAX_ATTEMPTS']:
+            state.app.logger.error('giving up on %r: %r', queued, error)
+            self.db.session.delete(queued)
+            with state.lock:
+                state.dropped += 1
+            return
+        delay = config['MAIL_QUEUE_BACKOFF'] * 2 ** (queued.attempts - 1)
+        queued.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+    def drain(self):
+        """send everything that is due right now (used by flask send-mail)."""
+        while self.deliver_batch():
+            pass
+
+    def _send_mail_command(self):
+        """Send every queued email that is due."""
+        self.drain()
+        state = self._state()
+        click.echo(f'sent {state.sent}, failed {state.failed}, still queued {self.depth()}')
+
+    # -- observability --------------------------------------------------
+
+    def depth(self):
+        from flaskblog.models import QueuedMail
+        return QueuedMail.query.count()
+
+    def stats(self):
+        state = self._state()
+        depth = self.depth()
+        with state.lock:
+            return {'depth': depth,
+                    'enqueued': state.enqueued,
+                    'sent': state.sent,
+                    'failed_attempts': state.failed,
+                    'dropped': state.dropped,
+                    'last_latency_seconds': state.last_latency,
+                    'avg_latency_seconds': state.latency_total / state.sent if state.sent else None,
+                    'last_batch_seconds': state.last_batch_seconds}
@@ -0,0 +1,106 @@
+"""Small schema migrations for an existing site.db.
+
+db.create_all() only creates tables that are missing, it never touches a table
+that is already there. So every change to an existing table (new index, new
+column ...) is written here as a numbered step. SQLite keeps the number of the
+last applied step in PRAGMA user_version, so running the upgrade again is a no-op.
+
+run it with:  flask upgrade-db"""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect
+from flaskblog import db
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """register the decorated function as schema step number `version`.
+    the function gets a connection that is already inside a transaction."""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda step: step[0])
+        return func
+    return decorator
+
+
+@migration(1, 'indexes for the post listings')
+def _add_listing_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_post_date_posted_id '
+                 'ON post (date_posted, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_post_user_id_date_posted '
+                 'ON post (user_id, date_posted, id)')
+
+
+@migration(2, 'outbox table for the mail queue')
+def _add_mail_outbox(conn):
+    from flaskblog.models import QueuedMail
+    QueuedMail.__table__.create(conn, checkfirst=True)
+
+
+@migration(3, 'full-text search table for the posts')
+def _add_post_search(conn):
+    from flaskblog.search import reindex
+    reindex(conn)
+
+
+@migration(4, 'excerpt and author columns for the post listings')
+def _add_listing_columns(conn, chunk=5000):
+    from flaskblog.models import make_excerpt
+    columns = {column['name'] for column in inspect(conn).get_columns('post')}
+    for name, ddl in (('excerpt', "VARCHAR(301) NOT NULL DEFAULT ''"),
+                      ('author_name', "VARCHAR(20) NOT NULL DEFAULT ''"),
+                      ('author_image', "VARCHAR(20) NOT NULL DEFAULT 'default.jpg'")):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE post ADD COLUMN {name} {ddl}')
+    conn.execute('UPDATE post SET (author_name, author_image) = '
+                 '(SELECT username, image_file FROM user WHERE user.id = post.user_id)')
+    # the excerpt needs python, walk the posts in id order, a chunk at a time
+    last_id = 0
+    while True:
+        rows = conn.execute('SELECT id, content FROM post WHERE id > ? ORDER BY id LIMIT ?',
+                            (last_id, chunk)).fetchall()
+        if not rows:
+            break
+        conn.execute('UPDATE post SET excerpt = ? WHERE id = ?',
+                     [(make_excerpt(content), post_id) for post_id, content in rows])
+        last_id = rows[-1][0]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').scalar()
+
+
+def upgrade_db(engine=None):
+    """create missing tables and apply every step newer than the database.
+    returns the list of applied (version, description)."""
+    engine = engine or db.engine
+    # a brand new database gets the whole schema from the models,
+    # so it only has to be stamped with the latest version
+    fresh = not inspect(engine).has_table('post')
+    db.metadata.create_all(bind=engine)
+    applied = []
+    with engine.begin() as conn:
+        version = current_version(conn)
+        if fresh and MIGRATIONS:
+            conn.execute(f'PRAGMA user_version = {int(MIGRATIONS[-1][0])}')
+            return applied
+        for step_version, description, func in MIGRATIONS:
+            if step_version <= version:
+                continue
+            func(conn)
+            # PRAGMA does not accept bound parameters, the version is our own int
+            conn.execute(f'PRAGMA user_version = {int(step_version)}')
+            applied.append((step_version, description))
+    return applied
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Bring the database schema up to date."""
+    applied = upgrade_db()
+    if not applied:
+        click.echo('Database is already up to date.')
+    for version, description in applied:
+        click.echo(f'Applied migration {version}: {description}')
@@ -1,15 +1,28 @@
 from datetime import datetime
-"""itsdangerous will make sure the only the user that has access to the
- email can reset their email. generate a secure token that allow user to reset
-their email"""
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flaskblog import db, login_manager, app
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import defer, lazyload
+from flaskblog import db, login_manager, identity_cache, reset_tokens
 from flask_login import UserMixin
 
+# the listings show this many characters of a post
+EXCERPT_LENGTH = 300
+
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    """the start of the content, cut at a word and with the white space collapsed."""
+    text = ' '.join(content.split())
+    if len(text) <= length:
+        return text
+    cut = text[:length]
+    if ' ' in cut:
+        cut = cut[:cut.rindex(' ')]
+    return cut.rstrip(' ,.;:') + '…'
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # runs on every request of a logged-in user, so it is served from a cache
+    return identity_cache.load(int(user_id))
 
 
 class User(db.Model, UserMixin):
@@ -23,24 +36,26 @@ class User(db.Model, UserMixin):
     it allow us to let say when we have a post we can use this 
     author attribute to get the user who created the post."""
     # lazy defines when SQLAlchemy will load the data from the database
-    posts = db.relationship('Post', backref='author', lazy=True)
+    """the author backref is joined-loaded: every listing shows the author's
+    username and picture, so loading the authors in the same SELECT as the
+    posts saves one extra query per post on every page."""
+    posts = db.relationship('Post', backref=db.backref('author', lazy='joined'), lazy=True)
 
+    """itsdangerous will make sure the only the user that has access to the
+    email can reset their email. generate a secure token that allow user to reset
+    their email (the serializer and the used-token store live in tokens.py)"""
     def get_reset_token(self, expires_sec=1800):
         # 1800 sec = 30 min
-        s = Serializer(app.config['SECRET_KEY'], expires_sec)
-        # s.dumps() help us to actually generate the token
-        """ {'user_id': self.id} is a payload. the payload is the part of 
-        transmitted data that is the actual intended message"""
-        return s.dumps({'user_id': self.id}).decode('utf-8')
+        return reset_tokens.dumps(self.id, self.password, expires_sec)
 
     @staticmethod
     def verify_reset_token(token):
-        s = Serializer(app.config['SECRET_KEY'])
-        try:
-            user_id = s.loads(token)['user_id']
-        except:
+        # a bad, expired or used token is rejected before the database is asked
+        payload = reset_tokens.loads(token)
+        if payload is None:
             return None
-        return User.query.get(user_id)
+        user = User.query.get(payload['user_id'])
+        return user if reset_tokens.matches(payload, user) else None
 
     """this will decide what info should be displayed about a user."""
     def __repr__(self):
@@ -53,6 +68,82 @@ class Post(db.Model):
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    """copies for the listings, kept current by the events below: a listing
+    reads these short columns instead of the whole content and the author row."""
+    excerpt = db.Column(db.String(EXCERPT_LENGTH + 1), nullable=False, default='', server_default='')
+    author_name = db.Column(db.String(20), nullable=False, default='', server_default='')
+    author_image = db.Column(db.String(20), nullable=False, default='default.jpg', server_default='default.jpg')
+
+    """every listing sorts by date_posted (newest first, id breaks ties) and
+    user_posts also filters by user_id. these indexes let SQLite walk the rows
+    in order instead of scanning and sorting the whole table.
+    existing databases get them through migrations.py (flask upgrade-db)."""
+    __table_args__ = (
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_post_user_id_date_posted', 'user_id', 'date_posted', 'id'),
+    )
+
+    @classmethod
+    def listing_options(cls):
+        """what the listings load: no content and no author join, the
+        templates use excerpt, author_name and author_image instead."""
+        return defer(cls.content), lazyload(cls.author)
+
+    @classmethod
+    def listing(cls):
+        """query for the listings."""
+        return cls.query.options(*cls.listing_options())
+
+    @classmethod
+    def listing_select(cls):
+        """the same as a select(), for the async engine (async_routes.py)."""
+        return select(cls).options(*cls.listing_options())
 
     def __repr__(self):
         return f"Post('{self.title}', '{self.date_posted}')"
+
+
+@event.listens_for(Post, 'before_insert')
+@event.listens_for(Post, 'before_update')
+def _fill_listing_columns(mapper, connection, post):
+    state = inspect(post)
+    if state.attrs.content.history.has_changes() or not post.excerpt:
+        post.excerpt = make_excerpt(post.content)
+    # a new post or a new author: read the author from the database, post.author
+    # may be a stale copy (current_user comes from the identity cache)
+    if post.user_id is not None and (state.key is None or not post.author_name
+                                     or state.attrs.user_id.history.has_changes()):
+        author = connection.execute(select(User.__table__.c.username, User.__table__.c.image_file)
+                                    .where(User.__table__.c.id == post.user_id)).first()
+        if author is not None:
+            post.author_name, post.author_image = author
+
+
+@event.listens_for(User, 'after_update')
+def _copy_author_to_posts(mapper, connection, user):
+    attrs = inspect(user).attrs
+    if attrs.username.history.has_changes() or attrs.image_file.history.has_changes():
+        connection.execute(Post.__table__.update()
+                           .where(Post.__table__.c.user_id == user.id)
+                           .values(author_name=user.username, author_image=user.image_file))
+
+
+class QueuedMail(db.Model):
+    """an email waiting in the outbox. mailqueue.py sends these in the background
+    and deletes them once the SMTP server accepted them."""
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    sender = db.Column(db.String(120), nullable=False)
+    # comma separated list of addresses
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # not sent before this time (retry backoff)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # a worker that picked the mail owns it until this time
+    claimed_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f"QueuedMail('{self.subject}', '{self.recipients}', attempts={self.attempts})"
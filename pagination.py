@@ -0,0 +1,137 @@
+"""Keyset (cursor) pagination for the post listings.
+
+OFFSET pagination has to walk over every row before the requested page and
+paginate() also runs a COUNT(*) on every request, so the deeper the page the
+slower it gets. Here we remember the (date_posted, id) of the first/last post
+that was shown and ask the database for the rows right before or after it,
+which costs the same on page 1 and on page 500."""
+import base64
+import time
+from datetime import datetime
+from sqlalchemy import tuple_
+from flaskblog.models import Post
+
+# how long a cached COUNT(*) is trusted (seconds)
+COUNT_CACHE_TTL = 60
+# at most this many counts are kept (one per user whose page was viewed)
+COUNT_CACHE_MAX_ENTRIES = 1000
+_count_cache = {}
+
+
+def encode_cursor(direction, post):
+    """direction is 'n' (older posts, next page) or 'p' (newer posts, previous page).
+    the token is opaque for the user, it is just urlsafe base64 of the sort key."""
+    raw = f'{direction}|{post.date_posted.isoformat()}|{post.id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """return (direction, date_posted, id) or None if the token is broken."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, date_posted, post_id = \
+            base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+        if direction not in ('n', 'p'):
+            return None
+        return direction, datetime.fromisoformat(date_posted), int(post_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+class KeysetPage:
+    """one page of posts plus the tokens to reach the neighbour pages."""
+
+    def __init__(self, items, has_next, has_prev):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = encode_cursor('n', items[-1]) if has_next and items else None
+        self.prev_cursor = encode_cursor('p', items[0]) if has_prev and items else None
+
+
+def keyset_criteria(cursor):
+    """(direction, filter, order_by) of the page the cursor points to.
+    direction is None for the first page, the filter is then None too."""
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        return None, None, (Post.date_posted.desc(), Post.id.desc())
+    direction, date_posted, post_id = decoded
+    # a row value comparison: SQLite can start the index walk right at the
+    # cursor with it. the spelled out version, date < X OR (date = X AND id < Y),
+    # is a full index scan from the newest post when X and Y are parameters
+    key = tuple_(Post.date_posted, Post.id)
+    if direction == 'n':
+        # everything older than the last post of the page we came from
+        return direction, key < tuple_(date_posted, post_id), (Post.date_posted.desc(), Post.id.desc())
+    # 'p': everything newer than the first post of the page we came from,
+    # walk upwards and flip it back so the newest post is still on top
+    return direction, key > tuple_(date_posted, post_id), (Post.date_posted.asc(), Post.id.asc())
+
+
+def keyset_page(direction, rows, per_page):
+    """the KeysetPage for the per_page + 1 rows fetched with keyset_criteria()."""
+    if direction == 'p':
+        return KeysetPage(list(reversed(rows[:per_page])), has_next=True, has_prev=len(rows) > per_page)
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_prev=direction == 'n')
+
+
+def keyset_paginate(query, cursor=None, per_page=5):
+    """newest-first pagination of a Post query keyed on (date_posted, id).
+
+    we fetch one extra row to know whether there is another page, so no
+    COUNT(*) is needed at all."""
+    direction, criteria, order_by = keyset_criteria(cursor)
+    if criteria is not None:
+        query = query.filter(criteria)
+    rows = query.order_by(*order_by).limit(per_page + 1).all()
+    return keyset_page(direction, rows, per_page)
+
+
+async def keyset_paginate_async(session, statement, cursor=None, per_page=5):
+    """keyset_paginate() for the async views, statement is a select(Post)."""
+    direction, criteria, order_by = keyset_criteria(cursor)
+    if criteria is not None:
+        statement = statement.where(criteria)
+    rows = (await session.scalars(statement.order_by(*order_by).limit(per_page + 1))).all()
+    return keyset_page(direction, rows, per_page)
+
+
+def _cached(key):
+    hit = _count_cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _remember(key, total):
+    now = time.monotonic()
+    _count_cache.pop(key, None)
+    if len(_count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+        # drop the expired counts, and if that is not enough the oldest ones
+        # (a dict keeps the insertion order, so the first keys are the oldest)
+        for old, (expires, _) in list(_count_cache.items()):
+            if expires <= now:
+                _count_cache.pop(old, None)
+        for old in list(_count_cache)[:len(_count_cache) - COUNT_CACHE_MAX_ENTRIES + 1]:
+            _count_cache.pop(old, None)
+    _count_cache[key] = (now + COUNT_CACHE_TTL, total)
+    return total
+
+
+def cached_count(key, query):
+    """COUNT(*) is only used for the 'Posts by user (N)' heading so we keep it
+    for a short while instead of counting on every page view."""
+    total = _cached(key)
+    return total if total is not None else _remember(key, query.count())
+
+
+async def cached_count_async(key, session, statement):
+    """cached_count() for the async views, statement is a select(func.count())."""
+    total = _cached(key)
+    return total if total is not None else _remember(key, await session.scalar(statement))
+
+
+def forget_count(key):
+    _count_cache.pop(key, None)
@@ -1,108 +1,109 @@
-import os
-import secrets
-# PIL or pillow will help us to work with picture (resize,rotate etc)
-from PIL import Image
 # url_for will found the exact location for us
-from flask import render_template, url_for, flash, redirect, request, abort
-from flaskblog import app, db, bcrypt, mail
+from flask import Blueprint, current_app, render_template, url_for, flash, redirect, request, abort, jsonify
+from flaskblog import db, hasher, mail_queue, page_cache, avatars, identity_cache, reset_tokens
+from flaskblog.database import read_only
 from flaskblog.forms import (RegistrationForm, LoginForm, UpdateAccountForm,
                              PostForm, RequestResetForm, ResetPasswordForm)
 from flaskblog.models import User, Post
+from flaskblog.pagination import keyset_paginate, cached_count, forget_count
+from flaskblog.search import search_posts
 from flask_login import login_user, current_user, logout_user, login_required
-from flask_mail import Message
 
+# all the pages of the blog, registered with the app in create_app()
+main = Blueprint('main', __name__)
 
-@app.route('/')
-@app.route("/home")
+
+def tag_posts(posts):
+    # the page shows these posts and their authors, so it must be dropped from
+    # the page cache when one of them changes
+    page_cache.tag(*(f'post:{post.id}' for post in posts),
+                   *(f'author:{post.user_id}' for post in posts))
+
+
+@main.route('/')
+@main.route("/home")
+@read_only
+@page_cache.cached
 def home():
-    # grab the page that we want,default page is 1, page number must be integer
-    page = request.args.get('page', 1, type=int)
-    """Pagination helps us to divide posts into different or multiple pages
-    (Post.date_posted.desc()) this query will help us to bring the latest post
-    to the top."""
+    # grab the cursor of the page that we want, no cursor means the first page
+    cursor = request.args.get('cursor')
+    """Pagination helps us to divide posts into different or multiple pages.
+    keyset_paginate() brings the latest post to the top and continues right
+    after the post the cursor points to, so deep pages are as fast as page 1."""
     # This query will grab all the post related data from database and will display it on home.
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
+    posts = keyset_paginate(Post.listing(), cursor=cursor, per_page=current_app.config['POSTS_PER_PAGE'])
+    page_cache.tag('home')
+    tag_posts(posts.items)
     return render_template('home.html', posts=posts)
 
 
-@app.route("/about")
+@main.route("/about")
+@read_only
+@page_cache.cached
 def about():
     return render_template('about.html', title='About')
 
 
-@app.route("/register", methods=['GET', 'POST'])
+@main.route("/register", methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     # create instance of RegistrationForm()
     form = RegistrationForm()
     if form.validate_on_submit():
         """Hashing the password will help us not to access the
         exact password that user entered, instead show us the
         hashed vesion of the password (hashed Hexa -decimal value)."""
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = hasher.generate_password_hash(form.password.data)
         user = User(username=form.username.data, email=form.email.data, password=hashed_password)
         db.session.add(user)
         db.session.commit()
         flash('Your account has been created! You are now able to log in', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', title='Register', form=form)
 
 
-@app.route("/login", methods=['GET', 'POST'])
+@main.route("/login", methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = LoginForm()
     if form.validate_on_submit():
         # check if the email is matching with the email which is already in database
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and hasher.check_password_hash(user.password, form.password.data):
+            # the cost factor was changed in the config since this hash was made,
+            # we have the plain password right now so store a new hash
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.generate_password_hash(form.password.data)
+                db.session.commit()
             # login_user is a function , it also takes remember option too
             login_user(user, remember=form.remember.data)
             next_page = request.args.get('next')
-            return redirect(next_page) if next_page else redirect(url_for('home'))
+            return redirect(next_page) if next_page else redirect(url_for('main.home'))
         else:
             flash('Login Unsuccessful. Please check email and password', 'danger')
     return render_template('login.html', title='Login', form=form)
 
 
-@app.route("/logout")
+@main.route("/logout")
 def logout():
     # logout_out is the function
     logout_user()
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
 
 # the argument is the actual picture form data
-# this function will save the user uploaded picture to our file system
 def save_picture(form_picture):
-    """ random_hex will randomize the name of the file or uploaded file and that's because
-    we may have multiple picture with same name and they might collide. """
-    random_hex = secrets.token_hex(8)
-    """Os module here will help us to save that picture will the uploaded extension.
-    it either be jpg or png. os.path.splitext() this statement will help us with that.
-    this function return two values.....1)filename without extension and 2) extension itself
-    form_picture passed as a parameter is gonna be the data from the field that the user submit."""
-    _, f_ext = os.path.splitext(form_picture.filename)
-    # combine the random hex with the file extension
-    picture_fn = random_hex + f_ext
-    # create the full path that where the file will be saved or stored
-    picture_path = os.path.join(app.root_path, 'static/profile_pics', picture_fn)
-
-    """we will resize the uploaded picture 'cause high pexels picture
-    may slow down our website"""
-    output_size = (128, 128)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    # Now save the actual picture.
-    i.save(picture_path)
-
-    return picture_fn
+    """the picture is not resized here anymore: decoding and resizing a big
+    upload would keep the request waiting. it is handed to the avatar workers
+    (images.py) which render all the sizes and then switch the user's
+    image_file over to the new picture."""
+    avatars.submit(current_user.id, form_picture)
 
 
 # @login_required means that the user must be logged in to access has account
-@app.route("/account", methods=['GET', 'POST'])
+@main.route("/account", methods=['GET', 'POST'])
 @login_required
 def account():
     form = UpdateAccountForm()
@@ -111,24 +112,25 @@ def account():
         if form.picture.data:
             # set the profile picture.
             # save picture() is the function
-            picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file
+            save_picture(form.picture.data)
+            flash('Your new picture is being processed and will show up in a moment.', 'info')
         # As the data is entered into form So that's why its form.username.data
         current_user.username = form.username.data
         current_user.email = form.email.data
         db.session.commit()
+        # the username and the picture are shown next to every post of this user
+        page_cache.invalidate(f'author:{current_user.id}')
+        identity_cache.forget(current_user.id)
         flash('Your account has been updated!', 'success')
-        return redirect(url_for('account'))
+        return redirect(url_for('main.account'))
     elif request.method == 'GET':
         # Populate the fields with the current_user data
         form.username.data = current_user.username
         form.email.data = current_user.email
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    return render_template('account.html', title='Account',
-                           image_file=image_file, form=form)
+    return render_template('account.html', title='Account', form=form)
 
 
-@app.route("/post/new", methods=['GET', 'POST'])
+@main.route("/post/new", methods=['GET', 'POST'])
 @login_required
 def new_post():
     form = PostForm()
@@ -138,21 +140,26 @@ def new_post():
         post = Post(title=form.title.data, content=form.content.data, author=current_user)
         db.session.add(post)
         db.session.commit()
+        forget_count(f'user:{current_user.id}')
+        page_cache.invalidate('home', f'user:{current_user.id}')
         flash('Your post has been created!', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     return render_template('create_post.html', title='New Post',
                            form=form, legend='New Post')
 
 
 # this will take us to a specific post
-@app.route("/post/<int:post_id>")
+@main.route("/post/<int:post_id>")
+@read_only
+@page_cache.cached
 def post(post_id):
     # query all the posts, if the post is found Good if not show no found url page
     post = Post.query.get_or_404(post_id)
+    tag_posts([post])
     return render_template('post.html', title=post.title, post=post)
 
 
-@app.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
+@main.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
 @login_required
 def update_post(post_id):
     post = Post.query.get_or_404(post_id)
@@ -165,8 +172,9 @@ def update_post(post_id):
         post.title = form.title.data
         post.content = form.content.data
         db.session.commit()
+        page_cache.invalidate(f'post:{post.id}')
         flash('Your post has been updated!', 'success')
-        return redirect(url_for('post', post_id=post.id))
+        return redirect(url_for('main.post', post_id=post.id))
     elif request.method == 'GET':
         # Populate form with the existance data.
         form.title.data = post.title
@@ -175,7 +183,7 @@ def update_post(post_id):
                            form=form, legend='Update Post')
 
 
-@app.route("/post/<int:post_id>/delete", methods=['POST'])
+@main.route("/post/<int:post_id>/delete", methods=['POST'])
 @login_required
 def delete_post(post_id):
     """if the one who is deleting post is not the current user the
@@ -187,20 +195,45 @@ def delete_post(post_id):
         abort(403)
     db.session.delete(post)
     db.session.commit()
+    forget_count(f'user:{current_user.id}')
+    # the pages around the deleted post shift as well
+    page_cache.invalidate(f'post:{post_id}', 'home', f'user:{current_user.id}')
     flash('Your post has been deleted!', 'success')
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
 
 # show posts of the specific user
-@app.route("/user/<string:username>")
+@main.route("/user/<string:username>")
+@read_only
+@page_cache.cached
 def user_posts(username):
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     # get the user
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user) \
-        .order_by(Post.date_posted.desc()) \
-        .paginate(page=page, per_page=5)
-    return render_template('user_posts.html', posts=posts, user=user)
+    posts = keyset_paginate(Post.listing().filter_by(user_id=user.id), cursor=cursor,
+                            per_page=current_app.config['POSTS_PER_PAGE'])
+    # the total is only shown in the heading, so a slightly stale count is fine
+    total = cached_count(f'user:{user.id}', Post.query.filter_by(author=user))
+    page_cache.tag(f'user:{user.id}', f'author:{user.id}')
+    tag_posts(posts.items)
+    return render_template('user_posts.html', posts=posts, user=user, total=total)
+
+
+# full-text search over the title and content of the posts
+@main.route("/search")
+@read_only
+def search():
+    q = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor')
+    results = search_posts(db.session, q, cursor=cursor, per_page=10)
+    return render_template('search.html', title='Search', q=q, results=results)
+
+
+# hit/miss counters of the page cache and the state of the mail queue
+@main.route("/stats")
+def stats():
+    return jsonify(page_cache=page_cache.stats(), identity_cache=identity_cache.stats(),
+                   mail_queue=mail_queue.stats(), reset_tokens=reset_tokens.stats())
 
 
 def send_reset_email(user):
@@ -209,32 +242,44 @@ def send_reset_email(user):
     """Message class helps to create an email.
     first is subject line,
     2nd in sender use such email that is not related to anyone. otherwise it may cause spam."""
+    # flask_mail is only imported when a mail is actually sent
+    from flask_mail import Message
     msg = Message('Password Reset Request',
                   sender='noreply@demo.com',
                   recipients=[user.email])
     msg.body = f'''To reset your password, visit the following link:
-{url_for('reset_token', token=token, _external=True)}
+{url_for('main.reset_token', token=token, _external=True)}
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
+    # only put it in the outbox, the mail queue sends it in the background
+    mail_queue.enqueue(msg)
+
+
+def limit_reset_requests():
+    # too many requests from this client or for this email: stop before the
+    # form queries the database and before a mail is queued
+    if not reset_tokens.allow(request.remote_addr,
+                              request.form.get('email') if request.method == 'POST' else None):
+        abort(429)
 
 
 """in the below route user will enter their email address in order
 to reset their password"""
 
 
-@app.route("/reset_password", methods=['GET', 'POST'])
+@main.route("/reset_password", methods=['GET', 'POST'])
 def reset_request():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     # make sure that the user is logged out before resetting their password
     form = RequestResetForm()
+    limit_reset_requests()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         send_reset_email(user)
         flash('An email has been sent with instructions to reset your password.', 'info')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_request.html', title='Reset Password', form=form)
 
 
@@ -242,22 +287,34 @@ def reset_request():
 with the token"""
 
 
-@app.route("/reset_password/<token>", methods=['GET', 'POST'])
+@main.route("/reset_password/<token>", methods=['GET', 'POST'])
 def reset_token(token):
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
-    # Verify the token (we have user here already)
-    user = User.verify_reset_token(token)
-    if user is None:
+        return redirect(url_for('main.home'))
+    if not reset_tokens.allow(request.remote_addr):
+        abort(429)
+    # Verify the token, a bad signature, an expired or used token never reaches the database
+    payload = reset_tokens.loads(token)
+    user = User.query.get(payload['user_id']) if payload else None
+    # and a token for an older password (the token was used already) is refused too
+    if not reset_tokens.matches(payload, user):
         flash('That is an invalid or expired token', 'warning')
-        return redirect(url_for('reset_request'))
+        return redirect(url_for('main.reset_request'))
     # Now the user is valid then show him the form
     form = ResetPasswordForm()
     if form.validate_on_submit():
         # now hash the new password also
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
-        user.password = hashed_password
+        hashed_password = hasher.generate_password_hash(form.password.data)
+        # the token can't be used a second time: it is marked as used before the
+        # commit, and the password only changes if it is still the one the token
+        # was issued for, so of two requests with the same token only one wins
+        reset_tokens.consume(payload)
+        updated = User.query.filter_by(id=user.id, password=user.password) \
+            .update({'password': hashed_password}, synchronize_session=False)
         db.session.commit()
+        if not updated:
+            flash('That is an invalid or expired token', 'warning')
+            return redirect(url_for('main.reset_request'))
         flash('Your password has been updated! You are now able to log in', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_token.html', title='Reset Password', form=form)
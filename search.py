@@ -0,0 +1,159 @@
+"""Full-text search over the posts with SQLite FTS5.
+
+post_fts is an FTS5 table that holds the title and the content of every post,
+its rowid is the id of the post. It is kept in sync by the Post mapper events
+below, so every insert/update/delete done through the ORM updates it in the
+same transaction. Anything written around the ORM (bulk imports ...) needs a
+`flask reindex-search` afterwards.
+
+results are ranked with bm25 (a title match weighs more than a content match)
+and paginated with a (rank, id) cursor just like the listings.
+
+FTS5 only exists in SQLite. On another database (DATABASE_URL=postgresql://...)
+there is no post_fts table and nothing is indexed, search_posts() then falls
+back to a LIKE filter over the posts, newest first."""
+import base64
+import click
+from markupsafe import Markup, escape
+from sqlalchemy import event, inspect, or_, text, DDL
+from flaskblog.models import Post
+from flaskblog.pagination import keyset_paginate
+
+CREATE_FTS = ("CREATE VIRTUAL TABLE IF NOT EXISTS post_fts "
+              "USING fts5(title, content, tokenize='porter unicode61')")
+# weight of the title and the content columns in bm25
+RANK = 'bm25(post_fts, 10.0, 1.0)'
+# snippet() marks the hits with these, they are swapped for <mark> after escaping
+_HIT_START, _HIT_END = '\x02', '\x03'
+
+# a new database gets the search table together with the post table
+event.listen(Post.__table__, 'after_create', DDL(CREATE_FTS).execute_if(dialect='sqlite'))
+
+
+def has_fts(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def _index_post(connection, post):
+    connection.execute(text('INSERT INTO post_fts (rowid, title, content) '
+                            'VALUES (:id, :title, :content)'),
+                       {'id': post.id, 'title': post.title, 'content': post.content})
+
+
+def _unindex_post(connection, post_id):
+    connection.execute(text('DELETE FROM post_fts WHERE rowid = :id'), {'id': post_id})
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_inserted(mapper, connection, post):
+    if has_fts(connection):
+        _index_post(connection, post)
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, connection, post):
+    attrs = inspect(post).attrs
+    if has_fts(connection) and (attrs.title.history.has_changes() or attrs.content.history.has_changes()):
+        _unindex_post(connection, post.id)
+        _index_post(connection, post)
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, post):
+    if has_fts(connection):
+        _unindex_post(connection, post.id)
+
+
+def reindex(connection):
+    """rebuild post_fts from the post table."""
+    if not has_fts(connection):
+        return
+    connection.execute(text(CREATE_FTS))
+    connection.execute(text('DELETE FROM post_fts'))
+    connection.execute(text('INSERT INTO post_fts (rowid, title, content) '
+                            'SELECT id, title, content FROM post'))
+    # merge the index segments, makes the following queries faster
+    connection.execute(text("INSERT INTO post_fts (post_fts) VALUES ('optimize')"))
+
+
+def match_expression(q):
+    """turn what the user typed into a safe FTS5 query: every word must appear.
+    quoting each word means characters like - : * " can't break the syntax."""
+    words = [word.replace('"', '') for word in q.split()]
+    return ' '.join(f'"{word}"' for word in words if word)
+
+
+def _encode_cursor(rank, post_id):
+    raw = f'{rank!r}|{post_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(token):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        rank, post_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+        return float(rank), int(post_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _highlight(snippet):
+    return Markup(str(escape(snippet)).replace(_HIT_START, '<mark>').replace(_HIT_END, '</mark>'))
+
+
+class SearchResults:
+    def __init__(self, hits, next_cursor):
+        # list of (post, snippet)
+        self.hits = hits
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+
+
+def search_posts(session, q, cursor=None, per_page=10):
+    """best matches first; bm25 is lower for better matches, the id breaks ties."""
+    expression = match_expression(q)
+    if not expression:
+        return SearchResults([], None)
+    if not has_fts(session.get_bind()):
+        return _search_like(q, cursor, per_page)
+    params = {'q': expression, 'limit': per_page + 1}
+    after = ''
+    decoded = _decode_cursor(cursor)
+    if decoded is not None:
+        after = f'AND ({RANK} > :rank OR ({RANK} = :rank AND rowid > :id))'
+        params['rank'], params['id'] = decoded
+    rows = session.execute(text(
+        f"SELECT rowid, {RANK} AS score, "
+        f"snippet(post_fts, 1, '{_HIT_START}', '{_HIT_END}', '…', 24) "
+        f"FROM post_fts WHERE post_fts MATCH :q {after} "
+        f"ORDER BY score, rowid LIMIT :limit"), params).fetchall()
+    next_cursor = _encode_cursor(rows[per_page - 1][1], rows[per_page - 1][0]) \
+        if len(rows) > per_page else None
+    rows = rows[:per_page]
+    posts = {post.id: post for post in Post.listing().filter(Post.id.in_([row[0] for row in rows]))}
+    hits = [(posts[row[0]], _highlight(row[2])) for row in rows if row[0] in posts]
+    return SearchResults(hits, next_cursor)
+
+
+def _search_like(q, cursor=None, per_page=10):
+    """the search without FTS5: every word must be in the title or the content.
+    it reads the whole post table, but works on every database."""
+    query = Post.listing()
+    for word in q.split():
+        # the word is matched literally, % and _ are not wildcards
+        pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(or_(Post.title.ilike(pattern, escape='\\'),
+                                 Post.content.ilike(pattern, escape='\\')))
+    page = keyset_paginate(query, cursor=cursor, per_page=per_page)
+    return SearchResults([(post, post.excerpt) for post in page.items], page.next_cursor)
+
+
+def init_app(app, db):
+    @app.cli.command('reindex-search')
+    def reindex_search_command():
+        """Rebuild the full-text search index of the posts."""
+        with db.engine.begin() as connection:
+            reindex(connection)
+        click.echo('Search index rebuilt.')
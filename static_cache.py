@@ -0,0 +1,90 @@
+"""Cache-forever serving of the static files.
+
+every url_for('static', ...) gets ?v=<hash of the file content>, so the url
+changes whenever the file changes. that makes it safe to tell browsers to keep
+the file for a year without asking again (Cache-Control: immutable).
+Profile pictures are already stored under the hash of their content
+(see images.py) so their url never needs the ?v.
+
+the ETag is the sha256 of the content too: unlike the default
+mtime-size ETag it is the same on every server and after every deploy, and a
+browser that sends it back in If-None-Match gets a 304 without a body."""
+import hashlib
+import os
+import re
+import threading
+from flask import current_app, request, send_from_directory, abort
+from werkzeug.utils import safe_join
+
+ONE_YEAR = 365 * 24 * 3600
+# profile_pics/<16 hex chars of sha256>_<size>.<ext>, the name is the content
+CONTENT_ADDRESSED = re.compile(r'^profile_pics/[0-9a-f]{16}_\d+\.(jpg|webp)$')
+
+
+def _sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _StaticCacheState:
+    """the digests of the static files of one app."""
+
+    def __init__(self):
+        # filename -> (mtime_ns, size, sha256), so a file is only hashed again when it changes
+        self.digests = {}
+        self.lock = threading.Lock()
+
+
+class StaticCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.url_defaults(self._add_version)
+        app.view_functions['static'] = self.send_static_file
+        app.extensions['static_cache'] = _StaticCacheState()
+
+    def file_digest(self, filename):
+        """sha256 of a file in the static folder, or None if it does not exist."""
+        state = current_app.extensions['static_cache']
+        path = safe_join(current_app.static_folder, filename)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        cached = state.digests.get(filename)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        digest = _sha256_of(path)
+        with state.lock:
+            state.digests[filename] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def _add_version(self, endpoint, values):
+        if endpoint != 'static' or 'v' in values:
+            return
+        filename = values.get('filename')
+        if not filename or CONTENT_ADDRESSED.match(filename):
+            return
+        digest = self.file_digest(filename)
+        if digest:
+            values['v'] = digest[:12]
+
+    def send_static_file(self, filename):
+        digest = self.file_digest(filename)
+        if digest is None:
+            abort(404)
+        immutable = CONTENT_ADDRESSED.match(filename) or request.args.get('v') == digest[:12]
+        max_age = ONE_YEAR if immutable else current_app.get_send_file_max_age(filename)
+        # conditional=True (the default) answers If-None-Match with a 304
+        response = send_from_directory(current_app.static_folder, filename,
+                                       etag=digest, max_age=max_age)
+        if immutable:
+            response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+        return response
@@ -0,0 +1,16 @@
+"""the repository root is the flaskblog package itself, so make it importable
+under that name when pytest is run from a checkout."""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import flaskblog  # noqa: F401
+except ImportError:
+    spec = importlib.util.spec_from_file_location('flaskblog', os.path.join(ROOT, '__init__.py'),
+                                                  submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['flaskblog'] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,96 @@
+"""the JSON read API: sparse fieldsets, cursor pagination, ETags and compression."""
+import gzip
+import json
+import pytest
+from flaskblog import db
+from flaskblog.api import routes as api_routes
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.models import Post
+
+
+@pytest.fixture
+def client():
+    app = bench_app(PAGE_CACHE_ENABLED=False)
+    with app.app_context():
+        seed(db, 3, 30)
+    return app.test_client()
+
+
+def get_json(client, url, **params):
+    response = client.get(url, query_string=params or None)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_sparse_fieldset(client):
+    data = get_json(client, '/api/v1/posts', fields='id,title')
+    assert all(set(post) == {'id', 'title'} for post in data['posts'])
+    post = get_json(client, '/api/v1/posts/3', fields='author,content')
+    assert set(post) == {'author', 'content'}
+    assert post['author']['username'].startswith('user')
+    # every field by default
+    assert set(get_json(client, '/api/v1/posts/3')) == set(api_routes.POST_FIELDS)
+
+
+def test_unknown_field_is_a_400(client):
+    response = client.get('/api/v1/posts', query_string={'fields': 'id,password'})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'unknown fields: password'
+
+
+def test_walk_the_cursor_links(client):
+    ids, pages = [], 0
+    url, params = '/api/v1/posts', {'per_page': 7, 'fields': 'id'}
+    while url:
+        data = get_json(client, url, **params)
+        ids += [post['id'] for post in data['posts']]
+        assert (data['prev'] is None) == (pages == 0)
+        # the links keep per_page and fields
+        pages, url, params = pages + 1, data['next'], {}
+    assert pages == 5
+    assert len(ids) == len(set(ids)) == 30
+    with client.application.app_context():
+        assert ids == [post.id for post in Post.query.order_by(Post.date_posted.desc(), Post.id.desc())]
+
+
+def test_user_posts_and_missing_user(client):
+    data = get_json(client, '/api/v1/users/user1/posts', fields='author', per_page=50)
+    assert data['posts'] and all(post['author']['username'] == 'user1' for post in data['posts'])
+    response = client.get('/api/v1/users/nobody/posts')
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'not found'}
+
+
+def test_weak_etag_gives_a_304(client):
+    first = client.get('/api/v1/posts')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    again = client.get('/api/v1/posts', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    # an edit changes the payload and so the ETag
+    with client.application.app_context():
+        post = Post.query.order_by(Post.date_posted.desc(), Post.id.desc()).first()
+        post.title = 'Edited'
+        db.session.commit()
+    assert client.get('/api/v1/posts', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_gzip_when_accepted(client, monkeypatch):
+    monkeypatch.setattr(api_routes, 'brotli', None)
+    plain = client.get('/api/v1/posts')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    zipped = client.get('/api/v1/posts', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(zipped.data)) == plain.get_json()
+    # too small to be worth it
+    small = client.get('/api/v1/posts/1', query_string={'fields': 'id'}, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+
+def test_brotli_when_installed_and_accepted(client):
+    brotli = pytest.importorskip('brotli')
+    response = client.get('/api/v1/posts', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.data))['posts']
@@ -0,0 +1,28 @@
+"""two apps in one process keep their own settings and caches."""
+from flaskblog import db, hasher, page_cache, reset_tokens
+from flaskblog.benchmarks.seed import bench_app, seed
+
+
+def test_two_apps_keep_their_own_state():
+    first = bench_app(SECRET_KEY='first', BCRYPT_LOG_ROUNDS=4)
+    second = bench_app(SECRET_KEY='second', BCRYPT_LOG_ROUNDS=5)
+    for app in (first, second):
+        with app.app_context():
+            seed(db, 2, 3)
+
+    with first.app_context():
+        assert hasher.rounds == 4
+        assert hasher.generate_password_hash('password').startswith('$2b$04$')
+        token = reset_tokens.dumps(1, 'hash')
+        assert reset_tokens.loads(token)['user_id'] == 1
+    with second.app_context():
+        assert hasher.rounds == 5
+        # signed with the key of the first app
+        assert reset_tokens.loads(token) is None
+
+    # only the first app has the home page cached
+    assert first.test_client().get('/').headers['X-Cache'] == 'MISS'
+    assert first.test_client().get('/').headers['X-Cache'] == 'HIT'
+    assert second.test_client().get('/').headers['X-Cache'] == 'MISS'
+    with second.app_context():
+        assert page_cache.stats()['hits'] == 0
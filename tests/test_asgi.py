@@ -0,0 +1,158 @@
+"""the async views of the ASGI mode (async_app.py) on a fresh process."""
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+from flaskblog import db, async_db, identity_cache, mail_queue, page_cache
+from flaskblog.async_app import AsyncBlog
+from flaskblog.benchmarks.seed import bench_app, seed, PASSWORD
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the first request of a new worker, before anything else ran a query
+COLD_REQUEST = '''
+import asyncio, sys
+sys.path.insert(0, sys.argv[1])
+import conftest
+from flaskblog.async_app import AsyncBlog
+from flaskblog.benchmarks.seed import bench_app
+from flaskblog import async_db
+
+asgi = AsyncBlog(bench_app(sys.argv[2], PAGE_CACHE_ENABLED=False))
+
+
+async def get(path):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    try:
+        await asgi({'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+                    'headers': [], 'http_version': '1.1', 'root_path': ''}, receive, send)
+    finally:
+        await async_db.dispose(asgi.app)
+    return sent[0]['status']
+
+print(asyncio.run(get(sys.argv[3])))
+'''
+
+
+def cold_status(db_path, path):
+    result = subprocess.run([sys.executable, '-c', COLD_REQUEST, TESTS_DIR, db_path, path],
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return int(result.stdout.split()[-1])
+
+
+def test_async_views_work_on_a_cold_process(tmp_path):
+    db_path = str(tmp_path / 'blog.db')
+    app = bench_app(db_path)
+    with app.app_context():
+        seed(db, 3, 20)
+    for path in ('/', '/home', '/user/user1'):
+        assert cold_status(db_path, path) == 200
+
+
+def asgi_app(tmp_path, **config):
+    config.setdefault('RESET_RATE_LIMIT_ENABLED', False)
+    app = bench_app(str(tmp_path / 'blog.db'), WTF_CSRF_ENABLED=False, BCRYPT_POOL_WORKERS=0,
+                    MAIL_QUEUE_WORKER=False, **config)
+    with app.app_context():
+        seed(db, 3, 20)
+    return AsyncBlog(app)
+
+
+async def call(asgi, method, path, messages=None, headers=()):
+    """(status, headers, body) of one request, or None when nothing was sent.
+    messages are what receive() returns, one plain empty body by default."""
+    messages = list(messages or [{'type': 'http.request', 'body': b''}])
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi({'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+                'headers': [(b'content-type', b'application/x-www-form-urlencoded')] + list(headers),
+                'http_version': '1.1', 'root_path': ''}, receive, send)
+    if not sent:
+        return None
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+def form(body, more_body=False):
+    return {'type': 'http.request', 'body': body, 'more_body': more_body}
+
+
+def test_user_and_page_cache_are_loaded_off_the_event_loop(tmp_path, monkeypatch):
+    asgi = asgi_app(tmp_path)
+    threads = []
+
+    def record(func):
+        def wrapper(*args):
+            threads.append(threading.current_thread())
+            return func(*args)
+        return wrapper
+
+    monkeypatch.setattr(identity_cache, 'load', record(identity_cache.load))
+    monkeypatch.setattr(page_cache, '_lookup', record(page_cache._lookup))
+
+    async def main():
+        try:
+            # anonymous: the page cache is looked up
+            status, headers, _ = await call(asgi, 'GET', '/')
+            assert (status, headers[b'x-cache']) == (200, b'MISS')
+            login = form(f'email=user1%40demo.com&password={PASSWORD}'.encode())
+            status, headers, _ = await call(asgi, 'POST', '/login', [login])
+            assert status == 302
+            cookie = headers[b'set-cookie'].split(b';')[0]
+            # logged in: the user is loaded
+            status, _, body = await call(asgi, 'GET', '/', headers=[(b'cookie', cookie)])
+            assert status == 200 and b'Logout' in body
+        finally:
+            await async_db.dispose(asgi.app)
+
+    asyncio.run(main())
+    # asyncio.run() runs the event loop on this thread
+    assert len(threads) == 2
+    assert threading.current_thread() not in threads
+
+
+def test_body_in_several_messages_and_disconnect(tmp_path):
+    asgi = asgi_app(tmp_path)
+
+    async def main():
+        try:
+            status, headers, _ = await call(asgi, 'POST', '/reset_password',
+                                            [form(b'email=user1', True), form(b'%40demo', True), form(b'.com')])
+            assert (status, headers[b'location']) == (302, b'/login')
+            # the client went away in the middle of the body: no response at all
+            assert await call(asgi, 'POST', '/reset_password',
+                              [form(b'email=user1', True), {'type': 'http.disconnect'}]) is None
+        finally:
+            await async_db.dispose(asgi.app)
+
+    asyncio.run(main())
+    with asgi.app.app_context():
+        assert mail_queue.depth() == 1
+
+
+def test_async_views_see_the_client_behind_a_proxy(tmp_path):
+    asgi = asgi_app(tmp_path, PROXY_FIX_X_FOR=1, RESET_RATE_LIMIT_ENABLED=True,
+                    RESET_IP_BURST=1, RESET_IP_PER_HOUR=1)
+
+    async def main():
+        try:
+            return [(await call(asgi, 'GET', '/reset_password', headers=[(b'x-forwarded-for', ip)]))[0]
+                    for ip in (b'10.0.0.1', b'10.0.0.2', b'10.0.0.1')]
+        finally:
+            await async_db.dispose(asgi.app)
+
+    assert asyncio.run(main()) == [200, 200, 429]
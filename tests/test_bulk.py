@@ -0,0 +1,30 @@
+"""flask export-data / import-data."""
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.migrations import MIGRATIONS, current_version
+from flaskblog.models import Post, User
+
+
+def test_round_trip_into_a_new_database(tmp_path):
+    source = bench_app(str(tmp_path / 'source.db'))
+    with source.app_context():
+        seed(db, 3, 50)
+    runner = source.test_cli_runner()
+    for kind in ('users', 'posts'):
+        result = runner.invoke(args=['export-data', kind, str(tmp_path / f'{kind}.csv')])
+        assert result.exit_code == 0, result.output
+
+    target = bench_app(str(tmp_path / 'target.db'))
+    runner = target.test_cli_runner()
+    for kind in ('users', 'posts'):
+        result = runner.invoke(args=['import-data', kind, str(tmp_path / f'{kind}.csv')])
+        assert result.exit_code == 0, result.output
+    with target.app_context():
+        assert User.query.count() == 3
+        post = Post.query.get(7)
+        assert post.author_name == post.author.username
+        assert post.excerpt
+        # marked as up to date, flask upgrade-db has nothing left to do
+        with db.engine.connect() as connection:
+            assert current_version(connection) == MIGRATIONS[-1][0]
+    assert 'already up to date' in runner.invoke(args=['upgrade-db']).output
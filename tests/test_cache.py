@@ -0,0 +1,92 @@
+"""page cache invalidation and the filesystem backend."""
+import os
+import pickle
+import stat
+import pytest
+from flask import before_render_template
+from flaskblog import db, page_cache
+from flaskblog.cache import FileSystemBackend
+from flaskblog.benchmarks.seed import bench_app, seed
+
+
+def make_client():
+    app = bench_app(PAGE_CACHE_ENABLED=True)
+    with app.app_context():
+        seed(db, 3, 20)
+    return app, app.test_client()
+
+
+def test_second_visit_is_a_hit():
+    _, client = make_client()
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+
+def test_invalidate_drops_the_page():
+    app, client = make_client()
+    client.get('/')
+    with app.app_context():
+        page_cache.invalidate('home')
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+
+
+def test_page_invalidated_while_rendering_is_not_stored():
+    app, client = make_client()
+
+    # an edit commits and invalidates 'home' after the view read the posts
+    def edit_during_render(sender, template, context, **extra):
+        page_cache.invalidate('home')
+
+    before_render_template.connect(edit_during_render, app)
+    try:
+        assert client.get('/').headers['X-Cache'] == 'MISS'
+    finally:
+        before_render_template.disconnect(edit_during_render, app)
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+
+def test_filesystem_backend_shares_pages(tmp_path):
+    app = bench_app(PAGE_CACHE_TYPE='filesystem', PAGE_CACHE_DIR=str(tmp_path / 'cache'))
+    with app.app_context():
+        seed(db, 3, 20)
+    client = app.test_client()
+    first = client.get('/')
+    assert first.headers['X-Cache'] == 'MISS'
+    hit = client.get('/')
+    assert hit.headers['X-Cache'] == 'HIT'
+    assert hit.data == first.data
+    assert stat.S_IMODE(os.stat(tmp_path / 'cache').st_mode) == 0o700
+
+
+def test_filesystem_backend_never_unpickles(tmp_path):
+    backend = FileSystemBackend(str(tmp_path / 'pages'))
+    backend.set('key', {'body': b'<p>hi</p>', 'status': 200})
+    assert backend.get('key') == {'body': b'<p>hi</p>', 'status': 200}
+    # a planted pickle is not loaded, it is a miss
+    with open(backend._path('planted'), 'wb') as f:
+        pickle.dump((None, 'value'), f)
+    assert backend.get('planted') is None
+
+
+def test_cache_directory_is_private(tmp_path):
+    directory = tmp_path / 'shared'
+    directory.mkdir(mode=0o777)
+    os.chmod(directory, 0o777)
+    FileSystemBackend(str(directory))
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+@pytest.mark.skipif(not hasattr(os, 'geteuid') or os.geteuid() != 0, reason='needs root to chown')
+def test_cache_directory_of_another_user_is_refused(tmp_path):
+    directory = tmp_path / 'planted'
+    directory.mkdir()
+    os.chown(directory, os.getuid() + 1, -1)
+    with pytest.raises(RuntimeError):
+        FileSystemBackend(str(directory))
+
+
+def test_default_cache_directory_is_in_the_instance_folder():
+    app = bench_app()
+    for setting in ('PAGE_CACHE_DIR', 'IDENTITY_CACHE_DIR', 'RESET_TOKEN_STORE_DIR'):
+        assert app.config[setting] == os.path.join(app.instance_path, 'cache')
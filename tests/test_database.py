@@ -0,0 +1,56 @@
+"""engine setup of database.py on a SQLite file."""
+import sqlite3
+from flask import g
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.database import READ_BIND
+
+
+def seeded_path(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    app = bench_app(path)
+    with app.app_context():
+        seed(db, 3, 20)
+        db.engine.dispose()
+        db.get_engine(app, bind=READ_BIND).dispose()
+    return path
+
+
+def test_both_engines_pool_their_connections(tmp_path):
+    app = bench_app(seeded_path(tmp_path))
+    with app.app_context():
+        assert type(db.engine.pool).__name__ == 'QueuePool'
+        assert type(db.get_engine(app, bind=READ_BIND).pool).__name__ == 'QueuePool'
+
+
+def test_reads_work_on_a_database_that_is_not_in_wal_mode(tmp_path):
+    path = seeded_path(tmp_path)
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode = delete')
+    connection.close()
+    # the first request only reads, through the read-only engine
+    client = bench_app(path, PAGE_CACHE_ENABLED=False).test_client()
+    assert client.get('/').status_code == 200
+    connection = sqlite3.connect(path)
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    connection.close()
+
+
+def test_pool_size_setting(tmp_path):
+    app = bench_app(seeded_path(tmp_path), DB_POOL_SIZE=3, DB_MAX_OVERFLOW=2)
+    with app.app_context():
+        assert db.engine.pool.size() == 3
+        assert db.get_engine(app, bind=READ_BIND).pool.size() == 3
+    # an in-memory database has no pool to size, the setting is ignored
+    app = bench_app(SQLALCHEMY_DATABASE_URI='sqlite://', DB_POOL_SIZE=3)
+    with app.app_context():
+        db.create_all()
+        assert type(db.engine.pool).__name__ == 'StaticPool'
+
+
+def test_scoped_session_get_bind(tmp_path):
+    app = bench_app(seeded_path(tmp_path))
+    with app.test_request_context():
+        assert db.session.get_bind() is db.engine
+        g.db_read_only = True
+        assert db.session.get_bind() is db.get_engine(app, bind=READ_BIND)
@@ -0,0 +1,57 @@
+"""passwords: the bcrypt length limit and the rehash on login."""
+from flaskblog import db, hasher
+from flaskblog.benchmarks.seed import bench_app, seed, PASSWORD
+from flaskblog.hashing import hash_rounds
+from flaskblog.models import User
+
+
+def make_app(path=None, **config):
+    config.setdefault('BCRYPT_LOG_ROUNDS', 4)
+    return bench_app(path, WTF_CSRF_ENABLED=False, PAGE_CACHE_ENABLED=False,
+                     BCRYPT_POOL_WORKERS=0, RESET_RATE_LIMIT_ENABLED=False, **config)
+
+
+def register(client, password):
+    return client.post('/register', data={'username': 'newbie', 'email': 'newbie@demo.com',
+                                          'password': password, 'confirm_password': password})
+
+
+def test_register_with_a_long_password_is_a_form_error():
+    app = make_app()
+    with app.app_context():
+        seed(db, 1, 0)
+    client = app.test_client()
+    # 73 bytes, and 37 characters that take 74 bytes in utf-8
+    for password in ('x' * 73, 'é' * 37):
+        response = register(client, password)
+        assert response.status_code == 200
+        assert b'at most 72 bytes' in response.data
+    with app.app_context():
+        assert User.query.filter_by(username='newbie').first() is None
+    assert register(client, 'x' * 72).status_code == 302
+
+
+def test_reset_with_a_long_password_is_a_form_error():
+    app = make_app()
+    with app.app_context():
+        seed(db, 1, 0)
+        token = User.query.get(1).get_reset_token()
+    password = 'x' * 100
+    response = app.test_client().post(f'/reset_password/{token}',
+                                      data={'password': password, 'confirm_password': password})
+    assert response.status_code == 200
+    assert b'at most 72 bytes' in response.data
+
+
+def test_login_rehashes_when_the_cost_changed(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    with make_app(path).app_context():
+        # the seeded users have a cost 4 hash
+        seed(db, 1, 0)
+    app = make_app(path, BCRYPT_LOG_ROUNDS=5)
+    response = app.test_client().post('/login', data={'email': 'user1@demo.com', 'password': PASSWORD})
+    assert response.status_code == 302
+    with app.app_context():
+        new_hash = User.query.get(1).password
+        assert hash_rounds(new_hash) == 5
+        assert hasher.check_password_hash(new_hash, PASSWORD)
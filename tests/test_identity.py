@@ -0,0 +1,75 @@
+"""the cache of the logged-in user: hits, misses, the TTL and forget(), and
+posts written by a cached (maybe outdated) user."""
+import time
+from flaskblog import db, identity_cache
+from flaskblog.benchmarks.seed import bench_app, seed, PASSWORD
+from flaskblog.models import User, Post
+
+TTL = 0.5
+
+
+def logged_in_client(ttl=TTL):
+    app = bench_app(WTF_CSRF_ENABLED=False, PAGE_CACHE_ENABLED=False, BCRYPT_POOL_WORKERS=0,
+                    IDENTITY_CACHE_TTL=ttl)
+    with app.app_context():
+        seed(db, 2, 0)
+    client = app.test_client()
+    assert client.post('/login', data={'email': 'user1@demo.com', 'password': PASSWORD}).status_code == 302
+    return client
+
+
+def counts(client):
+    with client.application.app_context():
+        stats = identity_cache.stats()
+    return stats['hits'], stats['misses']
+
+
+def rename_in_the_database(client, username):
+    # behind the back of the cache, like another process would
+    with client.application.app_context():
+        User.query.get(1).username = username
+        db.session.commit()
+
+
+def test_hit_and_miss():
+    client = logged_in_client()
+    assert b'user1' in client.get('/account').data
+    assert counts(client) == (0, 1)
+    rename_in_the_database(client, 'renamed')
+    # the second request is served from the cache, without a SELECT
+    assert b'value="user1"' in client.get('/account').data
+    assert counts(client) == (1, 1)
+    with client.application.app_context():
+        assert identity_cache.load(99) is None
+        assert counts(client) == (1, 2)
+
+
+def test_entry_expires_after_the_ttl():
+    client = logged_in_client()
+    client.get('/account')
+    rename_in_the_database(client, 'renamed')
+    time.sleep(TTL + 0.1)
+    assert b'value="renamed"' in client.get('/account').data
+    assert counts(client) == (0, 2)
+
+
+def test_account_update_forgets_the_user():
+    client = logged_in_client()
+    client.get('/account')
+    response = client.post('/account', data={'username': 'renamed', 'email': 'user1@demo.com'})
+    assert response.status_code == 302
+    hits, misses = counts(client)
+    assert b'value="renamed"' in client.get('/account').data
+    assert counts(client) == (hits, misses + 1)
+
+
+def test_new_post_takes_the_author_from_the_database():
+    client = logged_in_client(ttl=60)
+    client.get('/account')
+    rename_in_the_database(client, 'renamed')
+    # current_user still has the cached name ...
+    response = client.post('/post/new', data={'title': 'Fresh', 'content': 'hello'})
+    assert response.status_code == 302
+    # ... the listing copy has the real one
+    with client.application.app_context():
+        assert Post.query.filter_by(title='Fresh').one().author_name == 'renamed'
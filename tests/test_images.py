@@ -0,0 +1,95 @@
+"""profile pictures: the same upload processed twice at once, and a picture
+that is adopted while its last user drops it."""
+import io
+import os
+import threading
+from PIL import Image
+from flaskblog import db, avatars
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.images import content_name, variant_names
+from flaskblog.models import User
+
+
+def picture(color):
+    out = io.BytesIO()
+    Image.new('RGB', (300, 300), color).save(out, 'PNG')
+    return out.getvalue()
+
+
+def make_app(tmp_path):
+    app = bench_app(str(tmp_path / 'blog.db'), PROFILE_PICS_DIR=str(tmp_path / 'pics'))
+    os.makedirs(app.config['PROFILE_PICS_DIR'])
+    with app.app_context():
+        seed(db, 2, 0)
+    return app
+
+
+def files(app):
+    return sorted(os.listdir(app.config['PROFILE_PICS_DIR']))
+
+
+def test_same_upload_twice_at_once(tmp_path):
+    app = make_app(tmp_path)
+    data = picture('red')
+    name = content_name(data)
+    for _ in range(10):
+        for filename in files(app):
+            os.remove(os.path.join(app.config['PROFILE_PICS_DIR'], filename))
+        start = threading.Barrier(2)
+        results = []
+
+        def upload():
+            start.wait()
+            results.append(avatars._process(app, 1, data))
+
+        threads = [threading.Thread(target=upload) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [name, name]
+        # every variant is there and no temp file is left
+        assert files(app) == sorted(variant_names(name))
+    with app.app_context():
+        assert User.query.get(1).image_file == name
+
+
+def test_broken_upload_leaves_the_files_of_others_alone(tmp_path):
+    app = make_app(tmp_path)
+    good = avatars._process(app, 1, picture('red'))
+    assert avatars._process(app, 2, b'not a picture') is None
+    assert files(app) == sorted(variant_names(good))
+
+
+def test_picture_deleted_before_the_switch_is_rendered_again(tmp_path, monkeypatch):
+    app = make_app(tmp_path)
+    data = picture('blue')
+    name = avatars._process(app, 1, data)
+    # user 2 finds the files of the picture ...
+    exists = avatars._exists
+    calls = []
+
+    def exists_then_deleted(checked):
+        calls.append(checked)
+        if len(calls) == 1:
+            assert exists(checked)
+            # ... and user 1 drops it as the last user, so it is deleted
+            assert avatars._process(app, 1, picture('green'))
+            assert not exists(checked)
+            return True
+        return exists(checked)
+
+    monkeypatch.setattr(avatars, '_exists', exists_then_deleted)
+    assert avatars._process(app, 2, data) == name
+    assert all(os.path.exists(os.path.join(app.config['PROFILE_PICS_DIR'], filename))
+               for filename in variant_names(name))
+    with app.app_context():
+        assert User.query.get(2).image_file == name
+
+
+def test_picture_of_another_user_is_kept(tmp_path):
+    app = make_app(tmp_path)
+    shared = avatars._process(app, 1, picture('red'))
+    assert avatars._process(app, 2, picture('red')) == shared
+    avatars._process(app, 1, picture('green'))
+    assert set(variant_names(shared)) <= set(files(app))
@@ -0,0 +1,38 @@
+"""the sampling profiler keeps the samples of concurrent requests apart."""
+import asyncio
+import time
+from flaskblog.instrumentation import SamplingProfiler
+
+
+def busy_in_first(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def busy_in_second(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_tasks_on_one_event_loop_get_their_own_samples():
+    profiler = SamplingProfiler(0.001)
+
+    async def request(busy):
+        profiler.start()
+        for _ in range(5):
+            busy(0.02)
+            # let the other request run in between, like an await on the database
+            await asyncio.sleep(0.01)
+        return profiler.stop()
+
+    async def main():
+        return await asyncio.gather(request(busy_in_first), request(busy_in_second))
+
+    first, second = asyncio.run(main())
+    assert first and second
+    assert not any('busy_in_second' in stack for stack in first)
+    assert not any('busy_in_first' in stack for stack in second)
+    assert any('busy_in_first' in stack for stack in first)
+    assert any('busy_in_second' in stack for stack in second)
@@ -0,0 +1,21 @@
+"""every app's outbox sends with the settings of that app."""
+from flask_mail import Message
+from flaskblog import db, mail_queue
+from flaskblog.benchmarks.seed import bench_app
+
+
+def test_each_app_uses_its_own_mail_settings():
+    first = bench_app(TESTING=True, MAIL_QUEUE_WORKER=False)
+    with first.app_context():
+        db.create_all()
+        assert mail_queue.mail.state.suppress
+    # nothing listens on port 1, so this app can't deliver anything
+    second = bench_app(MAIL_SERVER='127.0.0.1', MAIL_PORT=1, MAIL_USE_TLS=False, MAIL_QUEUE_WORKER=False)
+    with second.app_context():
+        db.create_all()
+        mail_queue.enqueue(Message('Hi', sender='noreply@demo.com', recipients=['user@demo.com'], body='x'))
+        mail_queue.deliver_batch()
+        assert mail_queue.stats()['failed_attempts'] == 1
+    # and the first app still has its own Mail
+    with first.app_context():
+        assert mail_queue.mail.state.suppress
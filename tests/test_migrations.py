@@ -0,0 +1,60 @@
+"""flask upgrade-db on a site.db made by the original version of the blog."""
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, text
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app
+from flaskblog.migrations import MIGRATIONS, current_version, upgrade_db
+
+# the schema before any migration, as db.create_all() of the first models made it
+BASELINE = (
+    'CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(20) NOT NULL, '
+    'email VARCHAR(120) NOT NULL, image_file VARCHAR(20) NOT NULL, '
+    'password VARCHAR(60) NOT NULL, PRIMARY KEY (id), UNIQUE (username), UNIQUE (email))',
+    'CREATE TABLE post (id INTEGER NOT NULL, title VARCHAR(100) NOT NULL, '
+    'date_posted DATETIME NOT NULL, content TEXT NOT NULL, user_id INTEGER NOT NULL, '
+    'PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))',
+)
+
+
+def baseline_db(path):
+    engine = create_engine('sqlite:///' + str(path))
+    with engine.begin() as conn:
+        for ddl in BASELINE:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO user VALUES (1, 'user1', 'user1@demo.com', 'me.jpg', 'x')"))
+        conn.execute(text('INSERT INTO post VALUES (1, :title, :date, :content, 1)'),
+                     {'title': 'Hello', 'date': datetime(2020, 1, 1), 'content': 'first  post\n of the blog'})
+    return engine
+
+
+def test_upgrade_baseline_database(tmp_path):
+    # the app has a database of its own, the upgrade must only touch the engine it is given
+    app = bench_app(str(tmp_path / 'app.db'))
+    engine = baseline_db(tmp_path / 'site.db')
+    with app.app_context():
+        applied = upgrade_db(engine)
+        assert [version for version, _ in applied] == [version for version, _, _ in MIGRATIONS]
+        assert not inspect(db.engine).get_table_names()
+
+        with engine.connect() as conn:
+            assert current_version(conn) == MIGRATIONS[-1][0]
+            indexes = {index['name'] for index in inspect(conn).get_indexes('post')}
+            assert {'ix_post_date_posted_id', 'ix_post_user_id_date_posted'} <= indexes
+            assert inspect(conn).has_table('queued_mail')
+            assert conn.execute(text('SELECT excerpt, author_name, author_image FROM post')).one() == \
+                ('first post of the blog', 'user1', 'me.jpg')
+            assert conn.execute(text("SELECT rowid FROM post_fts WHERE post_fts MATCH 'blog'")).scalar() == 1
+
+        # the second run finds nothing to do
+        assert upgrade_db(engine) == []
+
+
+def test_new_database_is_created_and_stamped(tmp_path):
+    app = bench_app(str(tmp_path / 'app.db'))
+    engine = create_engine('sqlite:///' + str(tmp_path / 'new.db'))
+    with app.app_context():
+        assert upgrade_db(engine) == []
+        assert not inspect(db.engine).get_table_names()
+    with engine.connect() as conn:
+        assert {'user', 'post', 'queued_mail'} <= set(inspect(conn).get_table_names())
+        assert current_version(conn) == MIGRATIONS[-1][0]
@@ -0,0 +1,85 @@
+"""keyset pagination: walking the cursors forwards and backwards shows every
+post exactly once, also when posts share the same date_posted, and a broken
+cursor falls back to the first page."""
+import base64
+from datetime import datetime, timedelta
+import pytest
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.models import Post
+from flaskblog import pagination
+from flaskblog.pagination import keyset_paginate, encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def app():
+    app = bench_app(PAGE_CACHE_ENABLED=False)
+    with app.app_context():
+        seed(db, 3, 23)
+        # a group of posts with the same timestamp, only the id orders them
+        same = datetime.utcnow() - timedelta(days=400)
+        Post.query.filter(Post.id.between(5, 12)) \
+            .update({'date_posted': same}, synchronize_session=False)
+        db.session.commit()
+        yield app
+
+
+def newest_first():
+    return [post.id for post in Post.query.order_by(Post.date_posted.desc(), Post.id.desc())]
+
+
+def walk(per_page):
+    pages = [keyset_paginate(Post.query, per_page=per_page)]
+    while pages[-1].has_next:
+        pages.append(keyset_paginate(Post.query, cursor=pages[-1].next_cursor, per_page=per_page))
+    return pages
+
+
+@pytest.mark.parametrize('per_page', [1, 4, 5, 23, 50])
+def test_walk_forwards_shows_every_post_once(app, per_page):
+    pages = walk(per_page)
+    assert [post.id for page in pages for post in page.items] == newest_first()
+    assert not pages[0].has_prev
+    assert all(page.has_prev for page in pages[1:])
+
+
+@pytest.mark.parametrize('per_page', [1, 4, 5])
+def test_walk_backwards_gives_the_same_pages(app, per_page):
+    pages = walk(per_page)
+    page = pages[-1]
+    for expected in reversed(pages[:-1]):
+        page = keyset_paginate(Post.query, cursor=page.prev_cursor, per_page=per_page)
+        assert [post.id for post in page.items] == [post.id for post in expected.items]
+    assert not page.has_prev
+
+
+def b64(raw):
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+@pytest.mark.parametrize('cursor', ['', 'not base64!', 'eHl6',
+                                    b64(b'x|2020-01-01T00:00:00|1'),
+                                    b64(b'n|yesterday|1'),
+                                    b64(b'n|2020-01-01T00:00:00|one'),
+                                    b64(b'\xff\xfe')])
+def test_bad_cursor_is_the_first_page(app, cursor):
+    assert decode_cursor(cursor) is None
+    page = keyset_paginate(Post.query, cursor=cursor, per_page=5)
+    assert [post.id for post in page.items] == newest_first()[:5]
+    assert app.test_client().get('/', query_string={'cursor': cursor}).status_code == 200
+
+
+def test_cursor_round_trip(app):
+    post = Post.query.get(7)
+    assert decode_cursor(encode_cursor('n', post)) == ('n', post.date_posted, 7)
+
+
+def test_count_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(pagination, '_count_cache', {})
+    monkeypatch.setattr(pagination, 'COUNT_CACHE_MAX_ENTRIES', 10)
+    for user_id in range(25):
+        pagination._remember(f'user:{user_id}', user_id)
+    assert len(pagination._count_cache) == 10
+    # the newest counts are the ones that are kept
+    assert pagination._cached('user:24') == 24
+    assert pagination._cached('user:0') is None
@@ -0,0 +1,40 @@
+"""the listing pages must run the same number of SQL statements whatever the
+page size: one query for the posts (author name and picture are columns of
+post), no query per post."""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from flaskblog import db
+from flaskblog.benchmarks.seed import bench_app, seed
+
+
+def count_statements(client, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def statements_per_page(per_page, url):
+    app = bench_app(PAGE_CACHE_ENABLED=False, POSTS_PER_PAGE=per_page)
+    with app.app_context():
+        # enough users that a page of 50 posts has many different authors,
+        # and enough posts that user1 has more than 50
+        seed(db, 40, 4000)
+    client = app.test_client()
+    # the first request opens the connections and fills the count cache
+    client.get(url)
+    return count_statements(client, url)
+
+
+@pytest.mark.parametrize('url', ['/', '/user/user1'])
+def test_statements_do_not_grow_with_page_size(url):
+    assert statements_per_page(5, url) == statements_per_page(50, url)
@@ -0,0 +1,69 @@
+"""a password reset token works once, in every worker."""
+from flaskblog import db, hasher
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.models import User
+
+
+def make_app(path, **config):
+    return bench_app(path, WTF_CSRF_ENABLED=False, PAGE_CACHE_ENABLED=False, BCRYPT_LOG_ROUNDS=4,
+                     BCRYPT_POOL_WORKERS=0, RESET_RATE_LIMIT_ENABLED=False, **config)
+
+
+def reset(app, token, password):
+    client = app.test_client()
+    client.post(f'/reset_password/{token}', data={'password': password, 'confirm_password': password})
+    with app.app_context():
+        return hasher.check_password_hash(User.query.get(1).password, password)
+
+
+def test_a_used_token_is_refused_by_another_worker(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    first = make_app(path)
+    with first.app_context():
+        seed(db, 2, 0)
+        token = User.query.get(1).get_reset_token()
+    assert reset(first, token, 'first-new-password')
+    # another worker has its own (empty) store of used tokens
+    second = make_app(path)
+    assert not reset(second, token, 'second-new-password')
+    with second.app_context():
+        assert User.verify_reset_token(token) is None
+
+
+def test_of_two_resets_with_the_same_token_only_one_wins(tmp_path, monkeypatch):
+    path = str(tmp_path / 'blog.db')
+    app = make_app(path)
+    with app.app_context():
+        seed(db, 2, 0)
+        token = User.query.get(1).get_reset_token()
+        other_hash = hasher.generate_password_hash('other-request')
+    generate = hasher.generate_password_hash
+
+    def concurrent_reset(password):
+        # the other request commits while this one hashes its new password
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.update().where(User.__table__.c.id == 1)
+                               .values(password=other_hash))
+        return generate(password)
+
+    monkeypatch.setattr(hasher, 'generate_password_hash', concurrent_reset)
+    assert not reset(app, token, 'late-new-password')
+    with app.app_context():
+        assert hasher.check_password_hash(User.query.get(1).password, 'other-request')
+
+
+def statuses(app, clients):
+    client = app.test_client()
+    return [client.get('/reset_password', headers={'X-Forwarded-For': ip}).status_code for ip in clients]
+
+
+def test_rate_limit_per_client_behind_a_proxy(tmp_path):
+    limits = {'RESET_RATE_LIMIT_ENABLED': True, 'RESET_IP_BURST': 2, 'RESET_IP_PER_HOUR': 1}
+    clients = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    # every request comes from the proxy
+    app = bench_app(str(tmp_path / 'direct.db'), PAGE_CACHE_ENABLED=False, **limits)
+    assert statuses(app, clients) == [200, 200, 429]
+    # X-Forwarded-For tells the clients apart
+    app = bench_app(str(tmp_path / 'proxied.db'), PAGE_CACHE_ENABLED=False, PROXY_FIX_X_FOR=1, **limits)
+    assert statuses(app, clients) == [200, 200, 200]
+    assert statuses(app, ['10.0.0.1', '10.0.0.1']) == [200, 429]
@@ -0,0 +1,54 @@
+"""full-text search, and the fallback on databases without FTS5."""
+from sqlalchemy import create_mock_engine
+from flaskblog import db, search
+from flaskblog.benchmarks.seed import bench_app, seed
+from flaskblog.models import Post
+
+
+def make_app():
+    app = bench_app(PAGE_CACHE_ENABLED=False)
+    with app.app_context():
+        seed(db, 2, 0)
+        db.session.add_all([Post(title='Flask tips', content='keyset pagination with flask', user_id=1),
+                            Post(title='Cooking', content='100% butter_cake', user_id=2),
+                            Post(title='Other', content='nothing to see', user_id=2)])
+        db.session.commit()
+    return app
+
+
+def titles(results):
+    return sorted(post.title for post, _ in results.hits)
+
+
+def test_search_page():
+    response = make_app().test_client().get('/search', query_string={'q': 'flask'})
+    assert response.status_code == 200
+    assert b'Flask tips' in response.data
+    assert b'Cooking' not in response.data
+
+
+def test_like_fallback_finds_the_same_posts():
+    with make_app().app_context():
+        for q in ('flask', 'keyset flask', 'butter_cake'):
+            assert titles(search._search_like(q)) == titles(search.search_posts(db.session, q))
+        # % and _ are plain characters, not wildcards
+        assert titles(search._search_like('100%')) == ['Cooking']
+        assert titles(search._search_like('butter_')) == ['Cooking']
+        assert titles(search._search_like('%')) == ['Cooking']
+        assert titles(search._search_like('b_tter')) == []
+
+
+def test_no_fts_on_other_databases():
+    statements = []
+    engine = create_mock_engine('postgresql://', lambda sql, *args, **kwargs: statements.append(str(sql)))
+    db.metadata.create_all(engine, checkfirst=False)
+    assert any('CREATE TABLE post' in statement for statement in statements)
+    assert not any('post_fts' in statement for statement in statements)
+
+    # the mapper events and reindex() leave a database without FTS5 alone
+    post = Post(id=1, title='t', content='c', user_id=1)
+    statements.clear()
+    search._post_inserted(None, engine, post)
+    search._post_deleted(None, engine, post)
+    search.reindex(engine)
+    assert statements == []
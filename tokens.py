@@ -0,0 +1,158 @@
+"""Password reset tokens and the rate limits of the reset pages.
+
+tokens: one serializer per app (and expiry) is built once and reused. A
+token is checked in order of cost: signature (a HMAC, no database), expiry,
+then whether it was used already, and only then the user is loaded. A token
+works only once: it carries a fingerprint of the password hash it was issued
+for and a reset changes that hash, so after a reset the token is refused by
+every worker without any shared state. The new password is only written if
+the hash is still the old one, so of two concurrent resets with the same
+token only one gets through. Every token also carries a random jti that goes
+into an expiring store (the cache backends of cache.py, RESET_TOKEN_STORE_TYPE)
+when it is used: that refuses a replay before the user is even loaded.
+
+rate limits: every hit of /reset_password and /reset_password/<token> takes
+a token from the bucket of the client IP, a reset request also from the
+bucket of the email address. An empty bucket means 429 before the form is
+validated, so a flood never reaches SQLite or the SMTP server. The buckets
+live in the memory of the process."""
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature
+from flaskblog.cache import Counters, default_cache_dir, make_backend
+
+
+def password_fingerprint(password_hash):
+    # a digest, so the token (which is signed, not encrypted) shows nothing of the hash
+    return hashlib.sha256(password_hash.encode('utf-8')).hexdigest()[:16]
+
+
+class TokenBucketLimiter:
+    """one bucket per key: up to `capacity` hits in a burst, refilled with
+    `per_hour` tokens an hour. the least recently used buckets are dropped
+    beyond max_keys, so memory stays bounded."""
+
+    def __init__(self, capacity, per_hour, max_keys=100000):
+        self.capacity = capacity
+        self.rate = per_hour / 3600.0
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """take a token, False when the bucket is empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+class _ResetTokensState:
+    """the key, the used-token store, the limits and the counters of one app."""
+
+    def __init__(self, config):
+        self.secret_key = config['SECRET_KEY']
+        self.expires = config['RESET_TOKEN_MAX_AGE']
+        # expiry -> serializer, built once and reused
+        self.serializers = {}
+        self.used = make_backend(config, 'reset-tokens', setting='RESET_TOKEN_STORE')
+        self.enabled = config['RESET_RATE_LIMIT_ENABLED']
+        self.ip_limiter = TokenBucketLimiter(config['RESET_IP_BURST'], config['RESET_IP_PER_HOUR'])
+        self.email_limiter = TokenBucketLimiter(config['RESET_EMAIL_BURST'], config['RESET_EMAIL_PER_HOUR'])
+        self.counters = Counters('rejected', 'limited')
+
+    def serializer(self, expires):
+        serializer = self.serializers.get(expires)
+        if serializer is None:
+            serializer = self.serializers[expires] = Serializer(self.secret_key, expires)
+        return serializer
+
+
+class ResetTokens:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESET_TOKEN_MAX_AGE', 1800)
+        app.config.setdefault('RESET_TOKEN_STORE_TYPE', 'memory')
+        app.config.setdefault('RESET_TOKEN_STORE_MAX_ENTRIES', 100000)
+        app.config.setdefault('RESET_TOKEN_STORE_DIR', default_cache_dir(app))
+        app.config.setdefault('RESET_TOKEN_STORE_REDIS_URL', 'redis://localhost:6379/0')
+        app.config.setdefault('RESET_RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RESET_IP_BURST', 10)
+        app.config.setdefault('RESET_IP_PER_HOUR', 30)
+        app.config.setdefault('RESET_EMAIL_BURST', 3)
+        app.config.setdefault('RESET_EMAIL_PER_HOUR', 6)
+        app.extensions['reset_tokens'] = _ResetTokensState(app.config)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['reset_tokens']
+
+    # -- tokens ---------------------------------------------------------
+
+    def dumps(self, user_id, password_hash, expires=None):
+        state = self._state()
+        payload = {'user_id': user_id, 'jti': secrets.token_urlsafe(9),
+                   'pw': password_fingerprint(password_hash)}
+        return state.serializer(expires or state.expires).dumps(payload).decode('utf-8')
+
+    def loads(self, token):
+        """the payload of a valid, unexpired and unused token, else None.
+        doesn't touch the database."""
+        state = self._state()
+        try:
+            payload, header = state.serializer(state.expires).loads(token, return_header=True)
+            user_id, jti, fingerprint = payload['user_id'], payload['jti'], payload['pw']
+        except (BadSignature, KeyError, TypeError):
+            state.counters.add('rejected')
+            return None
+        if state.used.get('jti:' + jti) is not None:
+            state.counters.add('rejected')
+            return None
+        return {'user_id': user_id, 'jti': jti, 'pw': fingerprint, 'exp': header['exp']}
+
+    def matches(self, payload, user):
+        """the token was issued for the current password of this user."""
+        if payload is None or user is None:
+            return False
+        if password_fingerprint(user.password) != payload['pw']:
+            self._state().counters.add('rejected')
+            return False
+        return True
+
+    def consume(self, payload):
+        """the token was used, remember it until it expires."""
+        ttl = max(1, payload['exp'] - int(time.time()))
+        self._state().used.set('jti:' + payload['jti'], 1, ttl=ttl)
+
+    # -- rate limits ----------------------------------------------------
+
+    def allow(self, ip, email=None):
+        """False when this client (or this email address) asked too often."""
+        state = self._state()
+        if not state.enabled:
+            return True
+        allowed = state.ip_limiter.hit(ip or 'unknown') and \
+            (email is None or state.email_limiter.hit(email.strip().lower()))
+        if not allowed:
+            state.counters.add('limited')
+        return allowed
+
+    def stats(self):
+        state = self._state()
+        counts = state.counters.snapshot()
+        return {'rejected_tokens': counts['rejected'], 'rate_limited': counts['limited'],
+                'used_tokens': len(state.used)}
@@ -0,0 +1,11 @@
+"""Entry point for WSGI servers, e.g.
+    gunicorn --preload -w 4 flaskblog.wsgi:app
+with --preload the app (and every module it imports) is loaded once in the
+master process and the workers are forked from it.
+
+a forked process doesn't get the threads of its parent, so the background
+threads and pools (mail queue, bcrypt, avatars, profiler) are never started
+in the master: each one starts on first use, in the worker that needs it."""
+from flaskblog import create_app
+
+app = create_app()